@@ -1,5 +1,57 @@
+import json
+
 from django.contrib import admin
-from .models import Book, Genre, Borrow, Review
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Avg, OuterRef, Subquery
+from django.utils.functional import cached_property
+from .models import Book, Branch, Genre, Borrow, BorrowArchive, Review
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that never runs an unbounded COUNT(*).
+
+    Counts are capped at ``count_limit`` rows; past that, PostgreSQL planner
+    estimates are used instead so changelists stay fast on very large tables.
+    """
+    count_limit = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            estimate = self._table_estimate(connection, queryset.model._meta.db_table)
+            if estimate > self.count_limit:
+                return estimate
+
+        count = queryset.values('pk').order_by()[:self.count_limit + 1].count()
+        if count > self.count_limit and connection.vendor == 'postgresql':
+            return max(self._plan_estimate(connection, queryset), count)
+        return count
+
+    def _table_estimate(self, connection, table):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+            row = cursor.fetchone()
+        return row[0] if row else -1
+
+    def _plan_estimate(self, connection, queryset):
+        sql, params = queryset.values('pk').order_by().query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+@admin.register(Branch)
+class BranchAdmin(admin.ModelAdmin):
+    list_display = ['code', 'name', 'created_at']
+    search_fields = ['code', 'name']
 
 @admin.register(Genre)
 class GenreAdmin(admin.ModelAdmin):
@@ -7,22 +59,47 @@ class GenreAdmin(admin.ModelAdmin):
     search_fields = ['name']
 
 @admin.register(Book)
-class BookAdmin(admin.ModelAdmin):
-    list_display = ['title', 'author', 'genre', 'available', 'read_count', 'average_rating']
-    list_filter = ['genre', 'available', 'created_at']
-    search_fields = ['title', 'author', 'isbn']
+class BookAdmin(LargeTableAdmin):
+    list_display = ['title', 'author', 'genre', 'branch', 'available', 'read_count', 'average_rating']
+    list_filter = ['branch', 'genre', 'available', 'created_at']
+    list_select_related = ['genre', 'branch']
+    search_fields = ['title', 'author']
+    autocomplete_fields = ['genre', 'branch']
     readonly_fields = ['read_count', 'created_at', 'updated_at']
 
+    def get_queryset(self, request):
+        average = Review.objects.filter(book=OuterRef('pk')).values('book').annotate(
+            average=Avg('rating')
+        ).values('average')
+        return super().get_queryset(request).annotate(_average_rating=Subquery(average))
+
+    @admin.display(description='Average rating', ordering='_average_rating')
+    def average_rating(self, obj):
+        return round(obj._average_rating, 2) if obj._average_rating is not None else 0
+
 @admin.register(Borrow)
-class BorrowAdmin(admin.ModelAdmin):
-    list_display = ['user', 'book', 'borrowed_on', 'returned', 'returned_on']
-    list_filter = ['returned', 'borrowed_on']
+class BorrowAdmin(LargeTableAdmin):
+    list_display = ['user', 'book', 'branch', 'borrowed_on', 'returned', 'returned_on']
+    list_filter = ['branch', 'returned', 'borrowed_on']
+    list_select_related = ['user', 'book', 'branch']
     search_fields = ['user__username', 'book__title']
+    autocomplete_fields = ['user', 'book']
     readonly_fields = ['borrowed_on']
 
+@admin.register(BorrowArchive)
+class BorrowArchiveAdmin(LargeTableAdmin):
+    list_display = ['id', 'user', 'book', 'borrowed_on', 'returned_on', 'archived_at']
+    list_filter = ['returned_on']
+    list_select_related = ['user', 'book']
+    search_fields = ['user__username', 'book__title']
+    autocomplete_fields = ['user', 'book']
+    readonly_fields = ['archived_at']
+
 @admin.register(Review)
-class ReviewAdmin(admin.ModelAdmin):
+class ReviewAdmin(LargeTableAdmin):
     list_display = ['user', 'book', 'rating', 'created_at']
     list_filter = ['rating', 'created_at']
+    list_select_related = ['user', 'book']
     search_fields = ['user__username', 'book__title', 'comment']
+    autocomplete_fields = ['user', 'book']
     readonly_fields = ['created_at', 'updated_at']
@@ -0,0 +1,137 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from .models import AnalyticsWatermark, Borrow, Review, DailyBorrowRollup, DailyRatingRollup
+from .routers import atomic_for
+
+
+def _watermark(name):
+    watermark, _ = AnalyticsWatermark.objects.select_for_update().get_or_create(name=name)
+    return watermark
+
+
+def _add_to_rollup(model, lookup, increments):
+    row = model.objects.filter(**lookup).first()
+    if row is None:
+        if any(value > 0 for value in increments.values()):
+            model.objects.create(**lookup, **increments)
+    else:
+        model.objects.filter(pk=row.pk).update(
+            **{field: F(field) + value for field, value in increments.items()}
+        )
+
+
+def _uncounted(watermark, rows, field, now, values):
+    """Rows stamped since the last run, re-reading the reorder window, minus those already counted.
+
+    Advances the watermark to ``now``; the caller saves it.
+    """
+    window = timedelta(seconds=settings.ANALYTICS_REORDER_WINDOW)
+    rows = rows.filter(**{f'{field}__lte': now})
+    if watermark.last_timestamp is not None:
+        rows = rows.filter(**{f'{field}__gt': watermark.last_timestamp - window})
+
+    counted = set(watermark.recent_ids)
+    uncounted, recent = [], []
+    for row in rows.values('id', field, *values).iterator():
+        if row[field] > now - window:
+            recent.append(row['id'])
+        if row['id'] not in counted:
+            uncounted.append(row)
+
+    watermark.last_timestamp = now
+    watermark.recent_ids = recent
+    return uncounted
+
+
+@atomic_for(AnalyticsWatermark)
+def rollup_borrows():
+    """Add borrows created since the last run to the daily rollups."""
+    watermark = _watermark('borrows')
+    borrows = _uncounted(watermark, Borrow.objects.all(), 'borrowed_on', timezone.now(), ['book__genre'])
+
+    totals = defaultdict(int)
+    for borrow in borrows:
+        totals[(timezone.localdate(borrow['borrowed_on']), borrow['book__genre'])] += 1
+
+    for (day, genre_id), count in totals.items():
+        _add_to_rollup(DailyBorrowRollup, {'day': day, 'genre_id': genre_id}, {'borrows': count})
+
+    watermark.save()
+    return len(borrows)
+
+
+@atomic_for(AnalyticsWatermark)
+def rollup_returns():
+    """Add loans returned since the last run, bucketed by return day."""
+    watermark = _watermark('returns')
+    returned = _uncounted(
+        watermark, Borrow.objects.filter(returned=True), 'returned_on', timezone.now(),
+        ['book__genre', 'borrowed_on'],
+    )
+
+    totals = defaultdict(lambda: {'returns': 0, 'total_loan_seconds': 0})
+    for borrow in returned:
+        key = (timezone.localdate(borrow['returned_on']), borrow['book__genre'])
+        totals[key]['returns'] += 1
+        totals[key]['total_loan_seconds'] += int(
+            (borrow['returned_on'] - borrow['borrowed_on']).total_seconds()
+        )
+
+    for (day, genre_id), increments in totals.items():
+        _add_to_rollup(DailyBorrowRollup, {'day': day, 'genre_id': genre_id}, increments)
+
+    watermark.save()
+    return len(returned)
+
+
+@atomic_for(AnalyticsWatermark)
+def rollup_reviews():
+    """Bring the rating distributions up to date with reviews written or edited since the last run.
+
+    Each review remembers the rating it was counted with, so an edit moves it
+    from the old bucket to the new one (both on the day it was created).
+    Deleted reviews stay counted.
+    """
+    watermark = _watermark('reviews')
+    now = timezone.now()
+    changed = Review.objects.filter(updated_at__lte=now).exclude(rolled_up_rating=F('rating'))
+    if watermark.last_timestamp is not None:
+        window = timedelta(seconds=settings.ANALYTICS_REORDER_WINDOW)
+        changed = changed.filter(updated_at__gt=watermark.last_timestamp - window)
+    changed = list(changed.values('id', 'rating', 'rolled_up_rating', 'created_at', 'book__genre'))
+
+    deltas = defaultdict(int)
+    for review in changed:
+        key = (timezone.localdate(review['created_at']), review['book__genre'])
+        deltas[key + (review['rating'],)] += 1
+        if review['rolled_up_rating'] is not None:
+            deltas[key + (review['rolled_up_rating'],)] -= 1
+
+    for (day, genre_id, rating), count in deltas.items():
+        if count:
+            _add_to_rollup(
+                DailyRatingRollup,
+                {'day': day, 'genre_id': genre_id, 'rating': rating},
+                {'count': count},
+            )
+
+    Review.objects.bulk_update(
+        [Review(id=review['id'], rolled_up_rating=review['rating']) for review in changed],
+        ['rolled_up_rating'], batch_size=1000,
+    )
+    watermark.last_timestamp = now
+    watermark.save()
+    return len(changed)
+
+
+def rollup_all():
+    return {
+        'borrows': rollup_borrows(),
+        'returns': rollup_returns(),
+        'reviews': rollup_reviews(),
+    }
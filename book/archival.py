@@ -0,0 +1,42 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Borrow, BorrowArchive
+from .routers import atomic_for
+
+
+def archive_returned_borrows(days=None, batch_size=None):
+    """Move returned borrows older than ``days`` into ``BorrowArchive``.
+
+    Each batch is copied and deleted in its own transaction so the live
+    table is never locked for the whole run.
+    """
+    days = settings.BORROW_ARCHIVE_AFTER_DAYS if days is None else days
+    batch_size = batch_size or settings.BORROW_ARCHIVE_BATCH_SIZE
+    cutoff = timezone.now() - timedelta(days=days)
+
+    archived = 0
+    while True:
+        with atomic_for(Borrow):
+            batch = list(
+                Borrow.objects.select_for_update(skip_locked=True).filter(
+                    returned=True, returned_on__lt=cutoff
+                ).order_by('id')[:batch_size]
+            )
+            if not batch:
+                return archived
+
+            BorrowArchive.objects.bulk_create([
+                BorrowArchive(
+                    id=borrow.id,
+                    user_id=borrow.user_id,
+                    book_id=borrow.book_id,
+                    branch_id=borrow.branch_id,
+                    borrowed_on=borrow.borrowed_on,
+                    returned_on=borrow.returned_on,
+                ) for borrow in batch
+            ])
+            Borrow.objects.filter(id__in=[borrow.id for borrow in batch]).delete()
+        archived += len(batch)
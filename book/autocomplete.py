@@ -0,0 +1,196 @@
+import bisect
+import heapq
+import threading
+import time
+import unicodedata
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFKD', text or '')
+    return ''.join(char for char in text if not unicodedata.combining(char)).casefold().strip()
+
+
+def index_keys(title, author):
+    """Keys a book can be found by: full title, full author and each of their words."""
+    title, author = normalize(title), normalize(author)
+    keys = {title, author}
+    keys.update(word for word in (title + ' ' + author).split() if len(word) > 1)
+    keys.discard('')
+    return keys
+
+
+class PrefixIndex:
+    """In-process prefix index over book titles and authors.
+
+    Keys live in one sorted list of ``(key, book_id)`` tuples, so a prefix
+    lookup is a bisect plus a scan over matching keys. The index holds at most
+    ``max_entries`` keys, keeping the most read books when it is full; a heap
+    of ``(read_count, book_id)`` finds the least read one to evict. Entries
+    for removed or re-counted books stay in the heap and are skipped.
+
+    Each index covers the books of one database; entries remember their
+    branch so searches can be limited to it.
+    """
+
+    def __init__(self, max_entries, rebuild_interval, using=DEFAULT_DB_ALIAS):
+        self.max_entries = max_entries
+        self.rebuild_interval = rebuild_interval
+        self.using = using
+        self._entries = []
+        self._books = {}
+        self._by_reads = []
+        self._built_at = None
+        self._lock = threading.RLock()
+        self._build_lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self._entries = []
+            self._books = {}
+            self._by_reads = []
+            self._built_at = None
+
+    def build(self):
+        from .models import Book
+
+        entries, books = [], {}
+        rows = Book.objects.using(self.using).order_by('-read_count', 'id').values_list(
+            'id', 'title', 'author', 'read_count', 'branch_id'
+        )
+        for book_id, title, author, read_count, branch_id in rows.iterator():
+            keys = index_keys(title, author)
+            if len(entries) + len(keys) > self.max_entries:
+                break
+            books[book_id] = (title, author, read_count, keys, branch_id)
+            entries.extend((key, book_id) for key in keys)
+        entries.sort()
+        by_reads = [(book[2], book_id) for book_id, book in books.items()]
+        heapq.heapify(by_reads)
+
+        with self._lock:
+            self._entries = entries
+            self._books = books
+            self._by_reads = by_reads
+            self._built_at = time.monotonic()
+
+    def is_stale(self):
+        return self._built_at is None or time.monotonic() - self._built_at > self.rebuild_interval
+
+    def ensure_built(self):
+        if not self.is_stale():
+            return
+        # One caller rebuilds. Others wait only for the first build and
+        # otherwise keep searching the previous index.
+        if not self._build_lock.acquire(blocking=self._built_at is None):
+            return
+        try:
+            if self.is_stale():
+                self.build()
+        finally:
+            self._build_lock.release()
+
+    def update(self, book_id, title, author, read_count, branch_id=None):
+        with self._lock:
+            if self._built_at is None:
+                return
+            current = self._books.get(book_id)
+            keys = index_keys(title, author)
+            if current is not None and current[3] == keys:
+                self._add(book_id, (title, author, read_count, keys, branch_id))
+                return
+
+            self._remove(book_id)
+            while len(self._entries) + len(keys) > self.max_entries:
+                least_read = self._least_read()
+                if least_read is None or self._books[least_read][2] >= read_count:
+                    return
+                self._remove(least_read)
+
+            self._add(book_id, (title, author, read_count, keys, branch_id))
+            for key in keys:
+                bisect.insort(self._entries, (key, book_id))
+
+    def remove(self, book_id):
+        with self._lock:
+            self._remove(book_id)
+
+    def _add(self, book_id, book):
+        self._books[book_id] = book
+        heapq.heappush(self._by_reads, (book[2], book_id))
+        if len(self._by_reads) > 2 * len(self._books) + 64:
+            self._by_reads = [(current[2], pk) for pk, current in self._books.items()]
+            heapq.heapify(self._by_reads)
+
+    def _least_read(self):
+        while self._by_reads:
+            read_count, book_id = self._by_reads[0]
+            current = self._books.get(book_id)
+            if current is not None and current[2] == read_count:
+                return book_id
+            heapq.heappop(self._by_reads)
+        return None
+
+    def _remove(self, book_id):
+        current = self._books.pop(book_id, None)
+        if current is None:
+            return
+        for key in current[3]:
+            position = bisect.bisect_left(self._entries, (key, book_id))
+            if position < len(self._entries) and self._entries[position] == (key, book_id):
+                del self._entries[position]
+
+    def search(self, query, limit, branch_id=None):
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        self.ensure_built()
+
+        with self._lock:
+            matches = set()
+            position = bisect.bisect_left(self._entries, (prefix,))
+            while position < len(self._entries) and self._entries[position][0].startswith(prefix):
+                book_id = self._entries[position][1]
+                if branch_id is None or self._books[book_id][4] == branch_id:
+                    matches.add(book_id)
+                position += 1
+            ranked = sorted(matches, key=lambda pk: (-self._books[pk][2], pk))[:limit]
+            return [
+                {
+                    'id': pk,
+                    'title': self._books[pk][0],
+                    'author': self._books[pk][1],
+                    'read_count': self._books[pk][2],
+                }
+                for pk in ranked
+            ]
+
+
+class BookIndexes:
+    """One ``PrefixIndex`` per database alias, since book ids are only unique within a database."""
+
+    def __init__(self, max_entries, rebuild_interval):
+        self.max_entries = max_entries
+        self.rebuild_interval = rebuild_interval
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, alias):
+        with self._lock:
+            if alias not in self._indexes:
+                self._indexes[alias] = PrefixIndex(self.max_entries, self.rebuild_interval, using=alias)
+            return self._indexes[alias]
+
+    def reset(self):
+        with self._lock:
+            indexes = list(self._indexes.values())
+        for index in indexes:
+            index.reset()
+
+
+book_index = BookIndexes(
+    max_entries=settings.AUTOCOMPLETE_MAX_ENTRIES,
+    rebuild_interval=settings.AUTOCOMPLETE_REBUILD_INTERVAL,
+)
@@ -0,0 +1,89 @@
+"""
+In-process GET sub-requests for ``/api/batch/``.
+
+Each sub-request is dispatched straight to its DRF view, skipping the
+middleware stack, and reuses the outer request's authenticated user and
+token so JWT decoding and the user lookup happen once per batch.
+"""
+import io
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import connections
+from django.http import Http404
+from django.urls import resolve
+from rest_framework.views import APIView
+
+from .routers import current_branch
+
+API_PREFIX = '/api/'
+
+
+def validate_path(path):
+    """Return ``(path, query)`` for an API path, or raise ``ValueError``."""
+    parts = urlsplit(path)
+    if parts.scheme or parts.netloc or not parts.path.startswith(API_PREFIX):
+        raise ValueError(f'Only {API_PREFIX} paths can be batched: {path}')
+    return parts.path, parts.query
+
+
+def build_subrequest(request, path, query):
+    environ = {
+        **request._request.META,
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': path,
+        'SCRIPT_NAME': '',
+        'QUERY_STRING': query,
+        'CONTENT_LENGTH': '0',
+        'wsgi.input': io.BytesIO(),
+    }
+    environ.pop('CONTENT_TYPE', None)
+    subrequest = WSGIRequest(environ)
+    subrequest.user = request.user
+    if request.user.is_authenticated:
+        # DRF's forced authentication hook: the view skips its authenticators.
+        subrequest._force_auth_user = request.user
+        subrequest._force_auth_token = request.auth
+    subrequest.branch_code = subrequest.GET.get('branch') or getattr(request, 'branch_code', None)
+    if hasattr(request._request, 'session'):
+        subrequest.session = request._request.session
+    return subrequest
+
+
+def run_subrequest(request, requested):
+    try:
+        path, query = validate_path(requested)
+        match = resolve(path)
+    except ValueError as exc:
+        return {'path': requested, 'status': 400, 'body': {'error': str(exc)}}
+    except Http404:
+        return {'path': requested, 'status': 404, 'body': {'error': 'Not found'}}
+
+    view_class = getattr(match.func, 'cls', None)
+    if view_class is None or not issubclass(view_class, APIView):
+        return {'path': requested, 'status': 400, 'body': {'error': f'{path} cannot be batched'}}
+
+    subrequest = build_subrequest(request, path, query)
+    subrequest.resolver_match = match
+    token = current_branch.set(subrequest.branch_code)
+    try:
+        response = match.func(subrequest, *match.args, **match.kwargs)
+    finally:
+        current_branch.reset(token)
+    return {'path': requested, 'status': response.status_code, 'body': response.data}
+
+
+def _run_in_thread(request, path):
+    try:
+        return run_subrequest(request, path)
+    finally:
+        # Worker threads open their own connections; don't leave them behind.
+        connections.close_all()
+
+
+def run_batch(request, paths, max_workers=1):
+    if max_workers <= 1 or len(paths) == 1:
+        return [run_subrequest(request, path) for path in paths]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(paths))) as executor:
+        return list(executor.map(lambda path: _run_in_thread(request, path), paths))
@@ -0,0 +1,212 @@
+"""
+Server-Sent Events for book availability, read counts and reviews.
+
+Writers append ``ChangeEvent`` rows in the same transaction as the change.
+Under ASGI each worker runs one ``EventBroker`` per database that polls the
+feed and fans new rows out to its connected clients, so a change made by any
+worker reaches every stream. Under WSGI the view answers with the pending
+batch and a ``retry`` hint instead of holding a worker; ``EventSource``
+reconnects with ``Last-Event-ID`` and picks up where it left off. In
+production this endpoint is served by the separate ASGI service in
+``render.yaml``.
+"""
+import asyncio
+import json
+import time
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Max, Q
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.views.decorators.http import require_GET
+
+from .models import Branch, ChangeEvent
+from .routers import current_branch
+
+
+def format_event(event):
+    data = {'book': event.book_id, 'genre': event.genre_id, **event.payload, 'at': event.created_at.isoformat()}
+    return f'id: {event.id}\nevent: {event.kind}\ndata: {json.dumps(data)}\n\n'
+
+
+def filter_events(queryset, book_ids, genre_ids, branch_id):
+    if branch_id is not None:
+        queryset = queryset.filter(branch_id=branch_id)
+    if book_ids or genre_ids:
+        queryset = queryset.filter(Q(book_id__in=book_ids) | Q(genre_id__in=genre_ids))
+    return queryset
+
+
+def latest_event_id():
+    return ChangeEvent.objects.aggregate(last=Max('id'))['last'] or 0
+
+
+class Subscription:
+    def __init__(self, book_ids, genre_ids, branch_id):
+        self.book_ids = book_ids
+        self.genre_ids = genre_ids
+        self.branch_id = branch_id
+        self.queue = asyncio.Queue(maxsize=settings.EVENTS_QUEUE_SIZE)
+        self.overflowed = False
+
+    def matches(self, event):
+        if self.branch_id is not None and event.branch_id != self.branch_id:
+            return False
+        if not self.book_ids and not self.genre_ids:
+            return True
+        return event.book_id in self.book_ids or event.genre_id in self.genre_ids
+
+    def deliver(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Slow client: end its stream; it reconnects and replays from the feed.
+            self.overflowed = True
+
+
+class EventBroker:
+    """Polls the change feed once per interval for all streams in this process."""
+
+    def __init__(self):
+        self.subscriptions = set()
+        self.cursor = None
+        self.delivered = {}
+        self.task = None
+
+    async def subscribe(self, subscription):
+        if self.cursor is None:
+            await sync_to_async(self.start)()
+        self.subscriptions.add(subscription)
+        loop = asyncio.get_running_loop()
+        if self.task is None or self.task.done() or self.task.get_loop() is not loop:
+            self.task = loop.create_task(self.run())
+
+    def unsubscribe(self, subscription):
+        self.subscriptions.discard(subscription)
+
+    async def run(self):
+        while self.subscriptions:
+            for event in await sync_to_async(self.poll)():
+                for subscription in list(self.subscriptions):
+                    if subscription.matches(event):
+                        subscription.deliver(event)
+            await asyncio.sleep(settings.EVENTS_POLL_INTERVAL)
+
+    def start(self):
+        window = timezone.now() - timedelta(seconds=settings.EVENTS_REORDER_WINDOW)
+        recent = ChangeEvent.objects.filter(created_at__gte=window).values_list('id', flat=True)
+        self.delivered = dict.fromkeys(recent, time.monotonic())
+        self.cursor = latest_event_id()
+
+    def poll(self):
+        # Ids are allocated before commit, so a row can become visible after a
+        # higher id; re-reading a short window of recent rows catches it.
+        window = timezone.now() - timedelta(seconds=settings.EVENTS_REORDER_WINDOW)
+        events = list(
+            ChangeEvent.objects.filter(Q(id__gt=self.cursor) | Q(created_at__gte=window))
+            .order_by('id')[:settings.EVENTS_BATCH_SIZE]
+        )
+        now = time.monotonic()
+        horizon = now - 2 * settings.EVENTS_REORDER_WINDOW
+        self.delivered = {event_id: seen for event_id, seen in self.delivered.items() if seen >= horizon}
+        fresh = [event for event in events if event.id not in self.delivered]
+        for event in fresh:
+            self.delivered[event.id] = now
+        if events:
+            self.cursor = max(self.cursor, events[-1].id)
+        return fresh
+
+
+# One broker per database alias, so per-branch databases each get their own feed.
+brokers = {}
+
+
+def get_broker():
+    alias = settings.BRANCH_DATABASES.get(current_branch.get())
+    if alias not in brokers:
+        brokers[alias] = EventBroker()
+    return brokers[alias]
+
+
+def parse_ids(value):
+    return {int(part) for part in value.split(',') if part.strip()} if value else set()
+
+
+async def stream_events(broker, subscription, backlog, cursor, truncated=False):
+    replayed = {event.id for event in backlog}
+    try:
+        yield f'retry: {settings.EVENTS_RETRY_MS}\n' + ('\n' if backlog else f'id: {cursor}\n\n')
+        for event in backlog:
+            yield format_event(event)
+        if truncated:
+            return
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), settings.EVENTS_HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                yield ': keep-alive\n\n'
+                continue
+            if subscription.overflowed:
+                return
+            if event.id not in replayed:
+                yield format_event(event)
+    finally:
+        broker.unsubscribe(subscription)
+
+
+@require_GET
+async def event_stream(request):
+    """Stream book changes, optionally limited with ``?book=1,2`` and ``?genre=3``."""
+    try:
+        book_ids = parse_ids(request.GET.get('book'))
+        genre_ids = parse_ids(request.GET.get('genre'))
+        last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        return JsonResponse({"error": "book, genre and Last-Event-ID must be integers"}, status=400)
+
+    branch_id = None
+    branch_code = getattr(request, 'branch_code', None)
+    if branch_code:
+        branch_id = await Branch.objects.filter(code=branch_code).values_list('id', flat=True).afirst()
+        if branch_id is None:
+            return JsonResponse({"error": "Branch not found"}, status=404)
+
+    streaming = isinstance(request, ASGIRequest)
+    if streaming:
+        broker = get_broker()
+        subscription = Subscription(book_ids, genre_ids, branch_id)
+        # Subscribe before reading the backlog so nothing falls between the two.
+        await broker.subscribe(subscription)
+
+    handed_off = False
+    try:
+        backlog = []
+        if last_event_id is not None:
+            queryset = filter_events(ChangeEvent.objects.filter(id__gt=last_event_id), book_ids, genre_ids, branch_id)
+            backlog = [event async for event in queryset.order_by('id')[:settings.EVENTS_BATCH_SIZE]]
+            cursor = last_event_id
+        else:
+            cursor = await sync_to_async(latest_event_id)()
+
+        if not streaming:
+            body = f'retry: {settings.EVENTS_RETRY_MS}\n' + ('\n' if backlog else f'id: {cursor}\n\n')
+            body += ''.join(format_event(event) for event in backlog)
+            response = HttpResponse(body, content_type='text/event-stream')
+        else:
+            # A full batch may stop short of the broker's cursor; the stream then
+            # ends after it so the client reconnects from the last replayed id.
+            truncated = len(backlog) == settings.EVENTS_BATCH_SIZE
+            response = StreamingHttpResponse(
+                stream_events(broker, subscription, backlog, cursor, truncated), content_type='text/event-stream'
+            )
+            handed_off = True
+    finally:
+        if streaming and not handed_off:
+            broker.unsubscribe(subscription)
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from book.archival import archive_returned_borrows
+from book.routers import current_branch
+
+
+class Command(BaseCommand):
+    help = 'Move returned borrows older than the archive horizon into the archive table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help='Archive loans returned more than this many days ago')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Number of borrows moved per transaction')
+        parser.add_argument('--branch', default=None,
+                            help='Archive in this branch\'s database instead of default')
+
+    def handle(self, *args, **options):
+        token = current_branch.set(options['branch'])
+        try:
+            archived = archive_returned_borrows(options['days'], options['batch_size'])
+        finally:
+            current_branch.reset(token)
+        self.stdout.write(self.style.SUCCESS(f'Archived {archived} borrows'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+
+from booklending.schema import write_schema
+
+
+class Command(BaseCommand):
+    help = 'Generate the OpenAPI schema served at /swagger.json and /swagger.yaml'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help='Regenerate even if the API sources are unchanged')
+
+    def handle(self, *args, **options):
+        write_schema(force=options['force'])
+        self.stdout.write(self.style.SUCCESS(f'Schema written to {settings.OPENAPI_SCHEMA_DIR}'))
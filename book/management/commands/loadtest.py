@@ -0,0 +1,221 @@
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from book.models import Book, Borrow, Genre
+
+USER_PREFIX = 'loadtest_'
+SEARCH_TERMS = ['load', 'book', 'test', 'history', 'novel', 'science']
+DEFAULT_MIX = 'browse=40,search=20,login=5,borrow=20,stats=15'
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in VirtualUser.scenarios:
+            raise CommandError(f'Unknown scenario "{name}"; choose from {", ".join(VirtualUser.scenarios)}')
+        try:
+            mix[name] = float(weight)
+        except ValueError:
+            raise CommandError(f'Invalid weight for scenario "{name}"')
+    if not any(mix.values()):
+        raise CommandError('At least one scenario needs a positive weight')
+    return mix
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def find_double_borrows(book_ids, since):
+    """Return (book_id, first_borrow_id, second_borrow_id) for overlapping loans."""
+    violations = []
+    borrows = Borrow.objects.filter(book_id__in=book_ids, borrowed_on__gte=since).order_by('book_id', 'borrowed_on')
+    previous = None
+    for borrow in borrows:
+        if previous is not None and previous.book_id == borrow.book_id:
+            still_out = not previous.returned or previous.returned_on > borrow.borrowed_on
+            if still_out:
+                violations.append((borrow.book_id, previous.id, borrow.id))
+        previous = borrow
+    return violations
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.rejected = defaultdict(int)
+
+    def record(self, name, seconds, status, expected=(200, 201)):
+        with self.lock:
+            self.latencies[name].append(seconds)
+            if status is None or status >= 500:
+                self.errors[name] += 1
+            elif status not in expected:
+                self.rejected[name] += 1
+
+
+class VirtualUser(threading.Thread):
+    scenarios = ['browse', 'search', 'login', 'borrow', 'stats']
+
+    def __init__(self, base_url, username, password, mix, hot_books, deadline, metrics, hold, pages):
+        super().__init__(daemon=True)
+        self.base_url = base_url.rstrip('/')
+        self.username = username
+        self.password = password
+        self.names = list(mix)
+        self.weights = list(mix.values())
+        self.hot_books = hot_books
+        self.deadline = deadline
+        self.metrics = metrics
+        self.hold = hold
+        self.pages = pages
+        self.token = None
+
+    def request(self, name, method, path, data=None, expected=(200, 201)):
+        body = json.dumps(data).encode() if data is not None else None
+        req = urllib.request.Request(self.base_url + path, data=body, method=method)
+        req.add_header('Content-Type', 'application/json')
+        if self.token:
+            req.add_header('Authorization', f'Bearer {self.token}')
+
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(req, timeout=30) as response:
+                status, payload = response.status, response.read()
+        except urllib.error.HTTPError as exc:
+            status, payload = exc.code, exc.read()
+        except OSError:
+            status, payload = None, b''
+        self.metrics.record(name, time.perf_counter() - start, status, expected)
+        return status, payload
+
+    def login(self):
+        status, payload = self.request('login', 'POST', '/api/login/', {
+            'username': self.username, 'password': self.password
+        })
+        if status == 200:
+            self.token = json.loads(payload)['access']
+
+    def run(self):
+        self.login()
+        while time.monotonic() < self.deadline:
+            scenario = random.choices(self.names, weights=self.weights)[0]
+            getattr(self, scenario)()
+
+    def browse(self):
+        self.request('browse', 'GET', f'/api/books/?page={random.randint(1, self.pages)}')
+
+    def search(self):
+        self.request('search', 'GET', f'/api/books/?search={random.choice(SEARCH_TERMS)}')
+
+    def stats(self):
+        self.request('stats', 'GET', '/api/profile/stats/')
+
+    def borrow(self):
+        book_id = random.choice(self.hot_books)
+        status, _ = self.request('borrow', 'POST', f'/api/books/{book_id}/borrow/', expected=(201,))
+        if status == 201:
+            time.sleep(self.hold)
+            self.request('return', 'POST', f'/api/books/{book_id}/return_book/')
+
+
+class Command(BaseCommand):
+    help = 'Simulate concurrent library traffic against a running server and report latency and correctness'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--users', type=int, default=20, help='Number of concurrent virtual users')
+        parser.add_argument('--duration', type=float, default=30, help='Test duration in seconds')
+        parser.add_argument('--mix', default=DEFAULT_MIX,
+                            help=f'Scenario weights, e.g. "{DEFAULT_MIX}"')
+        parser.add_argument('--books', type=int, default=200, help='Books to seed')
+        parser.add_argument('--hot-books', type=int, default=5,
+                            help='Number of popular titles all borrowers contend for')
+        parser.add_argument('--hold', type=float, default=0.05,
+                            help='Seconds a borrowed book is kept before returning it')
+        parser.add_argument('--password', default='loadtest-password')
+
+    def handle(self, *args, **options):
+        mix = parse_mix(options['mix'])
+        usernames = self.seed(options['users'], options['books'], options['password'])
+        hot_books = list(
+            Book.objects.filter(title__startswith='Load Test Book').order_by('id').values_list('id', flat=True)[:options['hot_books']]
+        )
+        Book.objects.filter(id__in=hot_books).update(available=True)
+        Borrow.objects.filter(book_id__in=hot_books, returned=False).update(returned=True, returned_on=timezone.now())
+
+        pages = max(1, Book.objects.count() // 10)
+        stats = Stats()
+        started_at = timezone.now()
+        start = time.monotonic()
+        deadline = start + options['duration']
+        users = [
+            VirtualUser(options['base_url'], username, options['password'], mix, hot_books, deadline, stats, options['hold'], pages)
+            for username in usernames
+        ]
+        self.stdout.write(f'Running {len(users)} virtual users for {options["duration"]:.0f}s against {options["base_url"]}')
+        for user in users:
+            user.start()
+        for user in users:
+            user.join()
+        elapsed = time.monotonic() - start
+
+        self.report(stats, elapsed)
+        violations = find_double_borrows(hot_books, started_at)
+        style = self.style.ERROR if violations else self.style.SUCCESS
+        self.stdout.write(style(f'\nDouble-borrow violations: {len(violations)}'))
+        for book_id, first, second in violations[:10]:
+            self.stdout.write(f'  book {book_id}: borrows {first} and {second} overlap')
+
+    def seed(self, user_count, book_count, password):
+        existing = set(User.objects.filter(username__startswith=USER_PREFIX).values_list('username', flat=True))
+        usernames = [f'{USER_PREFIX}{i}' for i in range(user_count)]
+        hashed = make_password(password)
+        User.objects.bulk_create([
+            User(username=username, email=f'{username}@example.com', password=hashed)
+            for username in usernames if username not in existing
+        ])
+        User.objects.filter(username__in=usernames).update(password=hashed)
+
+        genres = [Genre.objects.get_or_create(name=name)[0] for name in ['Load Test Fiction', 'Load Test Science']]
+        seeded = Book.objects.filter(title__startswith='Load Test Book').count()
+        Book.objects.bulk_create([
+            Book(
+                title=f'Load Test Book {i}',
+                author=f'Load Test Author {i % 25}',
+                genre=genres[i % len(genres)],
+                description=random.choice(SEARCH_TERMS),
+            )
+            for i in range(seeded, book_count)
+        ])
+        return usernames
+
+    def report(self, stats, elapsed):
+        total = sum(len(values) for values in stats.latencies.values())
+        self.stdout.write(f'\n{total} requests in {elapsed:.1f}s ({total / elapsed:.1f} req/s)\n')
+        self.stdout.write(f'{"scenario":<10} {"count":>7} {"errors":>7} {"rejected":>9} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9}')
+        for name in sorted(stats.latencies):
+            values = stats.latencies[name]
+            self.stdout.write(
+                f'{name:<10} {len(values):>7} {stats.errors[name]:>7} {stats.rejected[name]:>9} '
+                f'{percentile(values, 50) * 1000:>9.1f} {percentile(values, 95) * 1000:>9.1f} '
+                f'{percentile(values, 99) * 1000:>9.1f}'
+            )
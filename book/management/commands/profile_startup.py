@@ -0,0 +1,92 @@
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Runs in a fresh interpreter so imports and first requests are really cold.
+PROBE = '''
+import json, os, sys, time
+timings = {}
+start = time.perf_counter()
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'booklending.settings')
+from django.core.wsgi import get_wsgi_application
+application = get_wsgi_application()
+timings['wsgi_application'] = time.perf_counter() - start
+
+mark = time.perf_counter()
+from django.urls import get_resolver
+get_resolver().url_patterns
+timings['urlconf'] = time.perf_counter() - mark
+
+if %(warmup)r:
+    mark = time.perf_counter()
+    from booklending.warmup import warm_up
+    warm_up()
+    timings['warmup'] = time.perf_counter() - mark
+
+from django.test import Client
+client = Client()
+requests = []
+for path in %(paths)r:
+    latencies = []
+    for _ in range(2):
+        mark = time.perf_counter()
+        status = client.get(path).status_code
+        latencies.append(time.perf_counter() - mark)
+    requests.append({'path': path, 'status': status, 'first': latencies[0], 'second': latencies[1]})
+timings['total'] = time.perf_counter() - start
+print(json.dumps({'timings': timings, 'requests': requests}))
+'''
+
+
+class Command(BaseCommand):
+    help = 'Report import-time and first-request latency breakdowns for a cold worker'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', action='append', dest='paths',
+                            help='URL to request (repeatable); defaults to a few public endpoints')
+        parser.add_argument('--top', type=int, default=15,
+                            help='Number of slowest top-level packages to list')
+        parser.add_argument('--warmup', action='store_true',
+                            help='Run the gunicorn preload warm-up before the first requests')
+
+    def handle(self, *args, **options):
+        paths = options['paths'] or ['/api/books/', '/api/genres/', '/swagger.json']
+        code = PROBE % {'paths': paths, 'warmup': options['warmup']}
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', code],
+            cwd=settings.BASE_DIR, env=os.environ.copy(), capture_output=True, text=True,
+        )
+        if result.returncode != 0:
+            errors = '\n'.join(line for line in result.stderr.splitlines() if not line.startswith('import time:'))
+            raise CommandError(f'Startup probe failed with exit code {result.returncode}:\n{errors[-2000:]}')
+
+        report = json.loads(result.stdout.strip().splitlines()[-1])
+
+        self.stdout.write('Startup phases:')
+        for phase, seconds in report['timings'].items():
+            self.stdout.write(f'  {phase:<20} {seconds * 1000:9.1f} ms')
+
+        self.stdout.write('\nSlowest imports by package (self time):')
+        for package, micros in self.import_times(result.stderr)[:options['top']]:
+            self.stdout.write(f'  {package:<30} {micros / 1000:9.1f} ms')
+
+        self.stdout.write('\nFirst vs second request:')
+        for request in report['requests']:
+            self.stdout.write(
+                f"  {request['path']:<30} [{request['status']}] "
+                f"first {request['first'] * 1000:8.1f} ms, second {request['second'] * 1000:8.1f} ms"
+            )
+
+    def import_times(self, stderr):
+        totals = defaultdict(int)
+        for line in stderr.splitlines():
+            if not line.startswith('import time:') or 'self [us]' in line:
+                continue
+            self_time, _, module = line[len('import time:'):].split('|')
+            totals[module.strip().split('.')[0]] += int(self_time)
+        return sorted(totals.items(), key=lambda item: item[1], reverse=True)
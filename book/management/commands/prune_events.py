@@ -0,0 +1,21 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from book.models import ChangeEvent
+
+
+class Command(BaseCommand):
+    help = 'Delete change-feed events older than the retention window'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=None,
+                            help='Keep events from the last this many hours')
+
+    def handle(self, *args, **options):
+        hours = options['hours'] or settings.EVENTS_RETENTION_HOURS
+        cutoff = timezone.now() - timedelta(hours=hours)
+        deleted, _ = ChangeEvent.objects.filter(created_at__lt=cutoff).delete()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} events'))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from book.analytics import rollup_all
+from book.routers import current_branch
+
+
+class Command(BaseCommand):
+    help = 'Incrementally update the daily borrow and rating rollup tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--branch', default=None,
+                            help='Roll up this branch\'s database instead of default')
+
+    def handle(self, *args, **options):
+        token = current_branch.set(options['branch'])
+        try:
+            processed = rollup_all()
+        finally:
+            current_branch.reset(token)
+        self.stdout.write(self.style.SUCCESS(
+            'Rolled up {borrows} borrows, {returns} returns and {reviews} reviews'.format(**processed)
+        ))
@@ -0,0 +1,121 @@
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from contextlib import suppress
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connections, transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from book.models import Book, Borrow
+
+ALIAS = 'sqlite_benchmark'
+
+
+def register_database(path, tuned):
+    """Point the benchmark alias at ``path``, with the shipped options or Django's defaults."""
+    connections.close_all()
+    settings.DATABASES[ALIAS] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': path,
+        # Django's defaults: rollback journal, deferred transactions, 5s timeout.
+        'OPTIONS': dict(settings.SQLITE_OPTIONS) if tuned else {},
+    }
+    connections.configure_settings(settings.DATABASES)
+    # Drop the previous mode's connection so the next one reads the new settings.
+    with suppress(AttributeError):
+        del connections[ALIAS]
+
+
+def worker(duration, write_ratio, books, user_id, seed, results):
+    random.seed(seed)
+    reads = writes = errors = 0
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        book_id = random.randint(1, books)
+        try:
+            if random.random() < write_ratio:
+                # Borrow/return cycle: read-then-write, like BookViewSet.borrow.
+                with transaction.atomic(using=ALIAS):
+                    available = Book.objects.using(ALIAS).values_list('available', flat=True).get(pk=book_id)
+                    if available:
+                        Borrow.objects.using(ALIAS).create(user_id=user_id, book_id=book_id)
+                        Book.objects.using(ALIAS).filter(pk=book_id).update(
+                            available=False, read_count=F('read_count') + 1
+                        )
+                    else:
+                        Borrow.objects.using(ALIAS).filter(book_id=book_id, returned=False).update(
+                            returned=True, returned_on=timezone.now()
+                        )
+                        Book.objects.using(ALIAS).filter(pk=book_id).update(available=True)
+                writes += 1
+            else:
+                list(
+                    Book.objects.using(ALIAS).filter(id__range=(book_id, book_id + 10))
+                    .annotate(borrows=Count('borrow')).values_list('id', 'title', 'borrows')
+                )
+                reads += 1
+        except OperationalError:
+            errors += 1
+    connections[ALIAS].close()
+    results.put((reads, writes, errors))
+
+
+class Command(BaseCommand):
+    help = 'Compare SQLite read/write throughput with default and tuned settings under concurrent processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8, help='Concurrent processes (simulated gunicorn workers)')
+        parser.add_argument('--duration', type=float, default=10, help='Seconds per mode')
+        parser.add_argument('--write-ratio', type=float, default=0.2, help='Fraction of operations that write')
+        parser.add_argument('--books', type=int, default=1000)
+        parser.add_argument('--mode', choices=['default', 'tuned', 'both'], default='both')
+
+    def handle(self, *args, **options):
+        modes = ['default', 'tuned'] if options['mode'] == 'both' else [options['mode']]
+        self.stdout.write(
+            f"{options['workers']} workers, {options['duration']:.0f}s per mode, "
+            f"{options['write_ratio']:.0%} writes\n"
+        )
+        self.stdout.write(f'{"mode":<8} {"reads/s":>10} {"writes/s":>10} {"locked":>8}')
+        for mode in modes:
+            reads, writes, errors = self.run_mode(mode == 'tuned', options)
+            self.stdout.write(
+                f'{mode:<8} {reads / options["duration"]:>10.0f} '
+                f'{writes / options["duration"]:>10.0f} {errors:>8}'
+            )
+
+    def run_mode(self, tuned, options):
+        with tempfile.TemporaryDirectory() as directory:
+            # The app's own schema, opened through Django with the configuration under test.
+            register_database(os.path.join(directory, 'benchmark.sqlite3'), tuned)
+            call_command('migrate', database=ALIAS, verbosity=0)
+            users = User.objects.using(ALIAS).bulk_create(
+                User(username=f'benchmark{seed}') for seed in range(options['workers'])
+            )
+            Book.objects.using(ALIAS).bulk_create(
+                Book(id=i, title=f'Book {i}', author='Benchmark') for i in range(1, options['books'] + 1)
+            )
+            # Children must open their own connections rather than share the parent's.
+            connections.close_all()
+
+            context = multiprocessing.get_context('fork')
+            results = context.Queue()
+            processes = [
+                context.Process(target=worker, args=(
+                    options['duration'], options['write_ratio'], options['books'], user.pk, seed, results
+                ))
+                for seed, user in enumerate(users)
+            ]
+            for process in processes:
+                process.start()
+            totals = [results.get() for _ in processes]
+            for process in processes:
+                process.join()
+        return tuple(sum(values) for values in zip(*totals))
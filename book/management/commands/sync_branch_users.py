@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Copy every account from default into each branch database's auth_user mirror"
+
+    def handle(self, *args, **options):
+        fields = [field.attname for field in User._meta.concrete_fields]
+        users = [User(**row) for row in User.objects.using('default').values(*fields).iterator()]
+        for code, alias in settings.BRANCH_DATABASES.items():
+            User._base_manager.using(alias).bulk_create(
+                users, batch_size=1000, update_conflicts=True, unique_fields=['id'],
+                update_fields=[name for name in fields if name != 'id'],
+            )
+            self.stdout.write(self.style.SUCCESS(f'Synced {len(users)} users to branch {code} ({alias})'))
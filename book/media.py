@@ -0,0 +1,128 @@
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date
+from django.views.decorators.http import require_http_methods
+
+CONTENT_HASH = re.compile(r'[0-9a-f]{64}')
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class FileRange:
+    """File-like view of ``length`` bytes of ``file`` starting at ``start``.
+
+    Exposes ``fileno()`` so WSGI servers with ``wsgi.file_wrapper`` support
+    (gunicorn) still send the range with sendfile() from the current offset.
+    """
+
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        size = self.remaining if size is None or size < 0 else min(size, self.remaining)
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def parse_range(header, size):
+    """Return ``(start, end)`` for a single byte range, ``None`` to serve the whole
+    file, or raise ``ValueError`` if the range cannot be satisfied."""
+    match = RANGE.match(header or '')
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        start, end = max(0, size - int(last)), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+def cache_headers(response, path, etag, stat):
+    if CONTENT_HASH.search(os.path.basename(path)):
+        response['Cache-Control'] = f'public, max-age={settings.MEDIA_IMMUTABLE_MAX_AGE}, immutable'
+    else:
+        response['Cache-Control'] = f'public, max-age={settings.MEDIA_MAX_AGE}'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+@require_http_methods(['GET', 'HEAD'])
+def serve_media(request, path):
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404('Not found')
+    try:
+        stat = os.stat(full_path)
+    except OSError:
+        raise Http404('Not found')
+    if not os.path.isfile(full_path):
+        raise Http404('Not found')
+
+    etag = f'"{stat.st_size:x}-{int(stat.st_mtime):x}"'
+    if etag in request.headers.get('If-None-Match', ''):
+        return cache_headers(HttpResponseNotModified(), path, etag, stat)
+
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+
+    sendfile_header = settings.MEDIA_SENDFILE_HEADER
+    if sendfile_header:
+        # Let the front-end proxy stream the file (and handle ranges) itself.
+        response = HttpResponse(content_type=content_type)
+        if sendfile_header.lower() == 'x-accel-redirect':
+            response[sendfile_header] = settings.MEDIA_SENDFILE_PREFIX + quote(path)
+        else:
+            response[sendfile_header] = full_path
+        return cache_headers(response, path, etag, stat)
+
+    byte_range = None
+    if_range = request.headers.get('If-Range')
+    if if_range is None or if_range == etag:
+        try:
+            byte_range = parse_range(request.headers.get('Range'), stat.st_size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{stat.st_size}'
+            return response
+
+    if byte_range is None:
+        start, length, status_code = 0, stat.st_size, 200
+    else:
+        start, length, status_code = byte_range[0], byte_range[1] - byte_range[0] + 1, 206
+
+    if request.method == 'HEAD':
+        response = HttpResponse(content_type=content_type, status=status_code)
+    elif byte_range is None:
+        response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+    else:
+        response = FileResponse(FileRange(open(full_path, 'rb'), start, length),
+                                content_type=content_type, status=status_code)
+    if byte_range is not None:
+        response['Content-Range'] = f'bytes {start}-{byte_range[1]}/{stat.st_size}'
+    response['Content-Length'] = length
+    return cache_headers(response, path, etag, stat)
@@ -0,0 +1,82 @@
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.db import connections
+
+from .routers import current_branch
+from .throttling import db_latency
+
+
+class BranchMiddleware:
+    """Read the branch from ``?branch=`` or the ``X-Branch`` header.
+
+    The code is exposed as ``request.branch_code`` for branch-scoped queries
+    and stored in ``current_branch`` for the database router.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = self.enter(request)
+        try:
+            return self.get_response(request)
+        finally:
+            current_branch.reset(token)
+
+    async def __acall__(self, request):
+        token = self.enter(request)
+        try:
+            return await self.get_response(request)
+        finally:
+            current_branch.reset(token)
+
+    def enter(self, request):
+        request.branch_code = request.GET.get('branch') or request.headers.get('X-Branch') or None
+        return current_branch.set(request.branch_code)
+
+
+def record_query_time(execute, sql, params, many, context):
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        db_latency.observe(time.perf_counter() - start)
+
+
+class DatabaseLatencyMiddleware:
+    """Time every query of the request for the load-shedding latency average."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with self.wrap_connections():
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        # Connections belong to the request's sync thread, where its queries run.
+        stack = await sync_to_async(self.wrap_connections)()
+        try:
+            return await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+
+    def wrap_connections(self):
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(record_query_time))
+        return stack
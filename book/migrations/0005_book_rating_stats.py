@@ -0,0 +1,42 @@
+# Generated by Django 5.2.4 on 2026-10-18 23:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_rating_stats(apps, schema_editor):
+    Review = apps.get_model('book', 'Review')
+    BookRatingStats = apps.get_model('book', 'BookRatingStats')
+    alias = schema_editor.connection.alias
+    stats = {}
+    rows = Review.objects.using(alias).values_list('book_id', 'rating').annotate(count=models.Count('id')).order_by()
+    for book_id, rating, count in rows:
+        row = stats.setdefault(book_id, BookRatingStats(book_id=book_id))
+        setattr(row, f'rating_{rating}', count)
+        row.review_count += count
+        row.rating_sum += rating * count
+    BookRatingStats.objects.using(alias).bulk_create(stats.values(), batch_size=1000)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book', '0004_borrow_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookRatingStats',
+            fields=[
+                ('book', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rating_stats', serialize=False, to='book.book')),
+                ('review_count', models.IntegerField(default=0)),
+                ('rating_sum', models.IntegerField(default=0)),
+                ('rating_1', models.IntegerField(default=0)),
+                ('rating_2', models.IntegerField(default=0)),
+                ('rating_3', models.IntegerField(default=0)),
+                ('rating_4', models.IntegerField(default=0)),
+                ('rating_5', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(backfill_rating_stats, migrations.RunPython.noop),
+    ]
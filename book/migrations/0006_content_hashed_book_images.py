@@ -0,0 +1,19 @@
+# Generated by Django 5.2.4 on 2026-10-18 23:54
+
+import book.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book', '0005_book_rating_stats'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='book',
+            name='image',
+            field=models.ImageField(blank=True, null=True, upload_to=book.models.book_image_upload_to),
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 5.2.4 on 2026-10-19 00:24
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def convert_watermarks(apps, schema_editor):
+    """Express the old id watermarks as timestamp + already-counted ids."""
+    AnalyticsWatermark = apps.get_model('book', 'AnalyticsWatermark')
+    Borrow = apps.get_model('book', 'Borrow')
+    BorrowArchive = apps.get_model('book', 'BorrowArchive')
+    Review = apps.get_model('book', 'Review')
+    alias = schema_editor.connection.alias
+    window = timedelta(seconds=settings.ANALYTICS_REORDER_WINDOW)
+
+    for watermark in AnalyticsWatermark.objects.using(alias):
+        if watermark.name == 'borrows' and watermark.last_id:
+            counted = [model.objects.using(alias).filter(id__lte=watermark.last_id) for model in (Borrow, BorrowArchive)]
+            latest = max(filter(None, (rows.aggregate(latest=models.Max('borrowed_on'))['latest'] for rows in counted)),
+                         default=None)
+            watermark.last_timestamp = latest
+            if latest is not None:
+                watermark.recent_ids = [
+                    pk for rows in counted
+                    for pk in rows.filter(borrowed_on__gt=latest - window).values_list('id', flat=True)
+                ]
+        elif watermark.name == 'returns' and watermark.last_timestamp:
+            watermark.recent_ids = list(Borrow.objects.using(alias).filter(
+                returned=True,
+                returned_on__gt=watermark.last_timestamp - window,
+                returned_on__lte=watermark.last_timestamp,
+            ).values_list('id', flat=True))
+        elif watermark.name == 'reviews':
+            # Reviews now carry the rating they were counted with; rescan from the start.
+            Review.objects.using(alias).filter(id__lte=watermark.last_id).update(rolled_up_rating=models.F('rating'))
+            watermark.last_timestamp = None
+        watermark.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book', '0008_change_events'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analyticswatermark',
+            name='recent_ids',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='review',
+            name='rolled_up_rating',
+            field=models.PositiveSmallIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['updated_at'], name='review_updated_idx'),
+        ),
+        migrations.RunPython(convert_watermarks, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='analyticswatermark',
+            name='last_id',
+        ),
+    ]
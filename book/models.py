@@ -1,6 +1,10 @@
-from django.db import models
+import hashlib
+import os
+
+from django.db import connections, models, router
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.utils import timezone
 
 class Genre(models.Model):
     name = models.CharField(max_length=100, unique=True)
@@ -9,17 +13,48 @@ class Genre(models.Model):
     def __str__(self):
         return self.name
 
+class Branch(models.Model):
+    code = models.SlugField(max_length=50, unique=True)
+    name = models.CharField(max_length=255)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name
+
+def book_image_upload_to(instance, filename):
+    """Content-addressed path, so a stored image never changes and can be cached forever."""
+    digest = hashlib.sha256()
+    for chunk in instance.image.chunks():
+        digest.update(chunk)
+    digest = digest.hexdigest()
+    extension = os.path.splitext(filename)[1].lower()
+    return f'book_images/{digest[:2]}/{digest}{extension}'
+
 class Book(models.Model):
     title = models.CharField(max_length=255)
     author = models.CharField(max_length=255)
     genre = models.ForeignKey(Genre, on_delete=models.SET_NULL, null=True)
+    branch = models.ForeignKey(Branch, on_delete=models.PROTECT, null=True, blank=True, related_name='books')
     description = models.TextField(blank=True)
-    image = models.ImageField(upload_to='book_images/', null=True, blank=True)
+    image = models.ImageField(upload_to=book_image_upload_to, null=True, blank=True)
     available = models.BooleanField(default=True)
     read_count = models.IntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['branch', 'available', '-read_count'], name='book_branch_available_idx'),
+            models.Index(fields=['branch', 'genre', '-read_count'], name='book_branch_genre_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember loaded state so saves only publish real availability changes.
+        instance._loaded_availability = (instance.__dict__.get('available'), instance.__dict__.get('read_count'))
+        return instance
+
     @property
     def average_rating(self):
         reviews = self.reviews.all()
@@ -33,6 +68,7 @@ class Book(models.Model):
 class Borrow(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     book = models.ForeignKey(Book, on_delete=models.CASCADE)
+    branch = models.ForeignKey(Branch, on_delete=models.PROTECT, null=True, blank=True)
     borrowed_on = models.DateTimeField(auto_now_add=True)
     returned = models.BooleanField(default=False)
     returned_on = models.DateTimeField(null=True, blank=True)
@@ -45,10 +81,35 @@ class Borrow(models.Model):
                 name='unique_active_borrow'
             )
         ]
+        indexes = [
+            models.Index(fields=['branch', 'book', 'returned'], name='borrow_branch_book_idx'),
+            models.Index(fields=['branch', 'user', '-borrowed_on'], name='borrow_branch_user_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.book.title}"
 
+class BorrowArchive(models.Model):
+    """Returned borrows moved out of the live ``Borrow`` table; ids are preserved."""
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_borrows')
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='archived_borrows')
+    branch = models.ForeignKey(Branch, on_delete=models.PROTECT, null=True, blank=True, related_name='+')
+    borrowed_on = models.DateTimeField()
+    returned_on = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    # Archived loans are always returned; lets them share BorrowSerializer.
+    returned = True
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-borrowed_on'], name='borrow_archive_user_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.book.title} (archived)"
+
 class Review(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='reviews')
@@ -58,10 +119,174 @@ class Review(models.Model):
     comment = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Rating as last counted in DailyRatingRollup; lets the rollup move edits.
+    rolled_up_rating = models.PositiveSmallIntegerField(null=True, blank=True, editable=False)
 
     class Meta:
         unique_together = ('user', 'book')
+        indexes = [
+            models.Index(fields=['updated_at'], name='review_updated_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what was loaded so rating aggregates can apply deltas on save.
+        instance._loaded_rating = (instance.__dict__.get('book_id'), instance.__dict__.get('rating'))
+        return instance
+
+    def save(self, *args, **kwargs):
+        # rolled_up_rating belongs to the analytics rollup; never write back a stale copy.
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.attname for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname != 'rolled_up_rating' and field.attname not in deferred
+            ]
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def upsert_for_borrower(cls, user_id, book_id, rating, comment):
+        """Insert or update a user's review in one statement, only if they borrowed the book.
+
+        Returns the saved review, or ``None`` if the user never borrowed the book.
+        Bypasses model signals; callers are responsible for rating aggregates.
+        """
+        alias = router.db_for_write(cls)
+        connection = connections[alias]
+        quote = connection.ops.quote_name
+        review, borrow, archive = (
+            quote(model._meta.db_table) for model in (cls, Borrow, BorrowArchive)
+        )
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        sql = f"""
+            INSERT INTO {review} (user_id, book_id, rating, comment, created_at, updated_at)
+            SELECT %s, %s, %s, %s, %s, %s
+            WHERE EXISTS (SELECT 1 FROM {borrow} WHERE user_id = %s AND book_id = %s)
+               OR EXISTS (SELECT 1 FROM {archive} WHERE user_id = %s AND book_id = %s)
+            ON CONFLICT (user_id, book_id) DO UPDATE SET
+                rating = EXCLUDED.rating,
+                comment = EXCLUDED.comment,
+                updated_at = EXCLUDED.updated_at
+            RETURNING id, user_id, book_id, rating, comment, created_at, updated_at
+        """
+        params = [user_id, book_id, rating, comment, now, now, user_id, book_id, user_id, book_id]
+        return next(iter(cls.objects.db_manager(alias).raw(sql, params)), None)
 
     def __str__(self):
         return f"{self.user.username} - {self.book.title} ({self.rating}/5)"
 
+class BookRatingStats(models.Model):
+    """Per-book rating aggregate, kept up to date on review writes."""
+    book = models.OneToOneField(Book, on_delete=models.CASCADE, primary_key=True, related_name='rating_stats')
+    review_count = models.IntegerField(default=0)
+    rating_sum = models.IntegerField(default=0)
+    rating_1 = models.IntegerField(default=0)
+    rating_2 = models.IntegerField(default=0)
+    rating_3 = models.IntegerField(default=0)
+    rating_4 = models.IntegerField(default=0)
+    rating_5 = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def histogram(self):
+        return {str(rating): getattr(self, f'rating_{rating}') for rating in range(1, 6)}
+
+    @property
+    def average_rating(self):
+        return self.rating_sum / self.review_count if self.review_count else 0
+
+    @classmethod
+    def apply_review_change(cls, book_id, added=None, removed=None):
+        deltas = {}
+        for rating, sign in ((added, 1), (removed, -1)):
+            if rating is None:
+                continue
+            for field, amount in ((f'rating_{rating}', sign), ('review_count', sign), ('rating_sum', sign * rating)):
+                deltas[field] = deltas.get(field, 0) + amount
+        deltas = {field: amount for field, amount in deltas.items() if amount}
+        if not deltas:
+            return
+
+        changes = {field: models.F(field) + amount for field, amount in deltas.items()}
+        changes['updated_at'] = timezone.now()
+        if not cls.objects.filter(book_id=book_id).update(**changes) and added is not None:
+            cls.objects.get_or_create(book_id=book_id)
+            cls.objects.filter(book_id=book_id).update(**changes)
+
+    @classmethod
+    def rebuild(cls, book_id):
+        counts = dict(
+            Review.objects.filter(book_id=book_id).values_list('rating').annotate(count=models.Count('id')).order_by()
+        )
+        values = {f'rating_{rating}': counts.get(rating, 0) for rating in range(1, 6)}
+        values['review_count'] = sum(counts.values())
+        values['rating_sum'] = sum(rating * count for rating, count in counts.items())
+        cls.objects.update_or_create(book_id=book_id, defaults=values)
+
+    def __str__(self):
+        return f"{self.book_id}: {self.review_count} reviews"
+
+
+
+class AnalyticsWatermark(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+    last_timestamp = models.DateTimeField(null=True, blank=True)
+    # Ids already counted inside the re-read window after last_timestamp.
+    recent_ids = models.JSONField(default=list, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
+
+class DailyBorrowRollup(models.Model):
+    day = models.DateField()
+    genre = models.ForeignKey(Genre, on_delete=models.SET_NULL, null=True, blank=True)
+    borrows = models.PositiveIntegerField(default=0)
+    returns = models.PositiveIntegerField(default=0)
+    total_loan_seconds = models.BigIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('day', 'genre')
+        ordering = ['day']
+
+    def __str__(self):
+        return f"{self.day} - {self.genre} ({self.borrows} borrows)"
+
+class DailyRatingRollup(models.Model):
+    day = models.DateField()
+    genre = models.ForeignKey(Genre, on_delete=models.SET_NULL, null=True, blank=True)
+    rating = models.PositiveSmallIntegerField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('day', 'genre', 'rating')
+        ordering = ['day', 'rating']
+
+    def __str__(self):
+        return f"{self.day} - {self.genre} ({self.rating}/5 x {self.count})"
+
+class ChangeEvent(models.Model):
+    """Append-only feed of book changes, polled by each worker's event broker."""
+    AVAILABILITY = 'availability'
+    REVIEW = 'review'
+    KIND_CHOICES = [
+        (AVAILABILITY, 'Availability'),
+        (REVIEW, 'Review'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    book_id = models.BigIntegerField()
+    genre_id = models.BigIntegerField(null=True, blank=True)
+    branch_id = models.BigIntegerField(null=True, blank=True)
+    payload = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    @classmethod
+    def publish(cls, kind, book, **payload):
+        return cls.objects.create(
+            kind=kind, book_id=book.pk, genre_id=book.genre_id, branch_id=book.branch_id, payload=payload
+        )
+
+    def __str__(self):
+        return f"{self.kind} #{self.id} (book {self.book_id})"
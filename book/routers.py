@@ -0,0 +1,64 @@
+from contextlib import ContextDecorator
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, router, transaction
+
+# Branch code for the current request, set by book.middleware.BranchMiddleware.
+current_branch = ContextVar('current_branch', default=None)
+
+# Accounts, tokens and sessions live only on default: the client chooses the
+# branch, so it must not also choose which database authenticates it.
+SHARED_APPS = {'auth', 'contenttypes', 'sessions', 'admin', 'token_blacklist'}
+
+
+class BranchRouter:
+    """Pin a request's queries to its branch's database.
+
+    ``settings.BRANCH_DATABASES`` maps branch codes to database aliases. Each
+    branch database carries the full schema; its ``auth_user`` table is a
+    mirror of default's (see ``book.signals.mirror_user_to_branches``) so
+    borrow and review foreign keys resolve. Requests without a mapped branch,
+    and all ``SHARED_APPS`` models, use ``default``.
+    """
+
+    def _branch_db(self, model):
+        if model._meta.app_label in SHARED_APPS:
+            return DEFAULT_DB_ALIAS
+        code = current_branch.get()
+        return settings.BRANCH_DATABASES.get(code) if code else None
+
+    def db_for_read(self, model, **hints):
+        return self._branch_db(model)
+
+    def db_for_write(self, model, **hints):
+        return self._branch_db(model)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if {obj1._meta.app_label, obj2._meta.app_label} & SHARED_APPS:
+            return True
+        return obj1._state.db == obj2._state.db
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None
+
+
+class atomic_for(ContextDecorator):
+    """``transaction.atomic`` on the database ``model`` is routed to for writes.
+
+    The alias is resolved on entry, so as a decorator it follows the branch of
+    each call rather than the one active at import time.
+    """
+
+    def __init__(self, model):
+        self.model = model
+
+    def _recreate_cm(self):
+        return type(self)(self.model)
+
+    def __enter__(self):
+        self.atomic = transaction.atomic(using=router.db_for_write(self.model))
+        return self.atomic.__enter__()
+
+    def __exit__(self, *exc_info):
+        return self.atomic.__exit__(*exc_info)
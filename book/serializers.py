@@ -1,8 +1,9 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate
+from django.conf import settings
 from django.utils import timezone
-from .models import Book, Genre, Borrow, Review
+from .models import Book, Branch, Genre, Borrow, Review
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -74,7 +75,7 @@ class LoginSerializer(serializers.Serializer):
 class BookCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = Book
-        fields = ['title', 'author', 'genre', 'description', 'image']
+        fields = ['title', 'author', 'genre', 'branch', 'description', 'image']
 
 class BookListSerializer(serializers.ModelSerializer):
     genre_name = serializers.CharField(source='genre.name', read_only=True)
@@ -83,7 +84,12 @@ class BookListSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Book
-        fields = ['id', 'title', 'author', 'genre_name', 'image', 'available', 'read_count', 'average_rating','description']
+        fields = ['id', 'title', 'author', 'genre_name', 'branch', 'image', 'available', 'read_count', 'average_rating','description']
+
+class BranchSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Branch
+        fields = ['id', 'code', 'name', 'created_at']
 
 class GenreSerializer(serializers.ModelSerializer):
     class Meta:
@@ -98,20 +104,30 @@ class BookSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Book
-        fields = ['id', 'title', 'author', 'genre', 'genre_id', 'description', 'image',
+        fields = ['id', 'title', 'author', 'genre', 'genre_id', 'branch', 'description', 'image',
                  'available', 'read_count', 'average_rating', 'review_count', 'created_at']
 
     def get_review_count(self, obj):
         return obj.reviews.count()
 
+class BorrowBookSerializer(serializers.ModelSerializer):
+    """Compact book for borrow listings, read from ``rating_average``/``rating_count`` annotations."""
+    genre_name = serializers.CharField(source='genre.name', read_only=True)
+    average_rating = serializers.ReadOnlyField(source='rating_average')
+    review_count = serializers.ReadOnlyField(source='rating_count')
+
+    class Meta:
+        model = Book
+        fields = ['id', 'title', 'author', 'genre_name', 'image', 'available', 'average_rating', 'review_count']
+
 class BorrowSerializer(serializers.ModelSerializer):
-    book = BookSerializer(read_only=True)
+    book = BorrowBookSerializer(read_only=True)
     user = serializers.StringRelatedField(read_only=True)
     days_borrowed = serializers.SerializerMethodField()
 
     class Meta:
         model = Borrow
-        fields = ['id', 'user', 'book', 'borrowed_on', 'returned', 'returned_on', 'days_borrowed']
+        fields = ['id', 'user', 'book', 'branch', 'borrowed_on', 'returned', 'returned_on', 'days_borrowed']
 
     def get_days_borrowed(self, obj):
         end_date = obj.returned_on if obj.returned else timezone.now()
@@ -134,3 +150,16 @@ class ReviewSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         validated_data['user'] = self.context['request'].user
         return super().create(validated_data)
+
+class MyReviewSerializer(serializers.Serializer):
+    rating = serializers.IntegerField(min_value=1, max_value=5)
+    comment = serializers.CharField(required=False, allow_blank=True, default='')
+
+class BatchSerializer(serializers.Serializer):
+    requests = serializers.ListField(child=serializers.CharField(), allow_empty=False)
+    parallel = serializers.BooleanField(required=False, default=False)
+
+    def validate_requests(self, value):
+        if len(value) > settings.BATCH_MAX_REQUESTS:
+            raise serializers.ValidationError(f'At most {settings.BATCH_MAX_REQUESTS} requests per batch.')
+        return value
@@ -0,0 +1,71 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .autocomplete import book_index
+from .models import Book, BookRatingStats, ChangeEvent, Review
+
+
+@receiver(post_save, sender=Book)
+def index_book(sender, instance, using, **kwargs):
+    values = (instance.pk, instance.title, instance.author, instance.read_count, instance.branch_id)
+    transaction.on_commit(lambda: book_index[using].update(*values), using=using)
+
+
+@receiver(post_save, sender=Book)
+def publish_availability(sender, instance, created, **kwargs):
+    current = (instance.available, instance.read_count)
+    if created or getattr(instance, '_loaded_availability', None) == current:
+        return
+    instance._loaded_availability = current
+    ChangeEvent.publish(ChangeEvent.AVAILABILITY, instance, available=instance.available,
+                        read_count=instance.read_count)
+
+
+@receiver(post_delete, sender=Book)
+def unindex_book(sender, instance, using, **kwargs):
+    book_id = instance.pk
+    transaction.on_commit(lambda: book_index[using].remove(book_id), using=using)
+
+
+@receiver(post_save, sender=Review)
+def update_rating_stats(sender, instance, created, **kwargs):
+    current = (instance.book_id, instance.rating)
+    previous = None if created else getattr(instance, '_loaded_rating', None)
+    if previous == current:
+        return
+    instance._loaded_rating = current
+    if not created and previous is None:
+        BookRatingStats.rebuild(instance.book_id)
+        return
+    if previous is not None and previous[0] != instance.book_id:
+        BookRatingStats.apply_review_change(previous[0], removed=previous[1])
+        previous = None
+    BookRatingStats.apply_review_change(
+        instance.book_id, added=instance.rating, removed=previous[1] if previous else None
+    )
+
+
+@receiver(post_save, sender=Review)
+def publish_review(sender, instance, created, **kwargs):
+    ChangeEvent.publish(ChangeEvent.REVIEW, instance.book, review_id=instance.pk,
+                        rating=instance.rating, created=created)
+
+
+@receiver(post_delete, sender=Review)
+def remove_rating_stats(sender, instance, **kwargs):
+    book_id, rating = getattr(instance, '_loaded_rating', (instance.book_id, instance.rating))
+    BookRatingStats.apply_review_change(book_id, removed=rating)
+
+
+@receiver(post_save, sender=User)
+def mirror_user_to_branches(sender, instance, using, raw=False, **kwargs):
+    """Copy accounts saved on default into each branch database's ``auth_user``."""
+    if raw or using != DEFAULT_DB_ALIAS:
+        return
+    fields = {field.attname: getattr(instance, field.attname)
+              for field in User._meta.concrete_fields if not field.primary_key}
+    for alias in set(settings.BRANCH_DATABASES.values()):
+        User._base_manager.using(alias).update_or_create(pk=instance.pk, defaults=fields)
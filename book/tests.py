@@ -1,9 +1,43 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import os
+import subprocess
+import tempfile
+import threading
+import time
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.db.utils import ConnectionHandler
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import User
-from rest_framework.test import APITestCase
+from django.utils import timezone
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+from rest_framework.test import APIClient, APITestCase
 from rest_framework import status
 from rest_framework_simplejwt.tokens import RefreshToken
-from .models import Book, Genre, Borrow, Review
+from booklending.schema import SCHEMA_SOURCES, clear_schema_cache, get_schema_documents, source_fingerprint
+from booklending.warmup import warm_up
+from .management.commands.loadtest import find_double_borrows, parse_mix
+from .autocomplete import book_index, PrefixIndex
+from .events import get_broker
+from .middleware import DatabaseLatencyMiddleware
+from .views import BorrowViewSet
+from .routers import BranchRouter, current_branch
+from .throttling import LatencyTracker, db_latency
+from .models import Book, BookRatingStats, Branch, ChangeEvent, Genre, Borrow, BorrowArchive, Review, DailyBorrowRollup, DailyRatingRollup
+
+# Declared in booklending/settings.py when running tests.
+BRANCH_TEST_DB = 'branch_test'
+
 
 class BookLendingAPITestCase(APITestCase):
     def setUp(self):
@@ -57,6 +91,28 @@ class BookLendingAPITestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.data['results']), 1)
     
+    def test_book_list_facets(self):
+        cache.clear()
+        Book.objects.create(title='Other Book', author='Other Author', genre=self.genre, available=False)
+        Book.objects.create(title='Third Book', author='Other Author', genre=self.genre)
+        # Page count, page, reviews, and one grouped query per facet.
+        with self.assertNumQueries(6):
+            response = self.client.get('/api/books/', {'facets': 'genre,available,author', 'search': 'Book'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        facets = response.data['facets']
+        self.assertEqual(facets['genre'], [{'value': 'Fiction', 'count': 3}])
+        self.assertEqual(facets['available'], [
+            {'value': True, 'count': 2}, {'value': False, 'count': 1}
+        ])
+        self.assertEqual(facets['author'], [
+            {'value': 'Other Author', 'count': 2}, {'value': 'Test Author', 'count': 1}
+        ])
+
+        cache.clear()
+        with self.settings(FACET_AUTHOR_LIMIT=1):
+            response = self.client.get('/api/books/', {'facets': 'author'})
+        self.assertEqual(response.data['facets']['author'], [{'value': 'Other Author', 'count': 2}])
+
     def test_book_borrow(self):
         self.authenticate()
         response = self.client.post(f'/api/books/{self.book.id}/borrow/')
@@ -136,3 +192,751 @@ class ModelTestCase(TestCase):
         
         with self.assertRaises(Exception):
             Borrow.objects.create(user=self.user, book=self.book)
+
+
+class AnalyticsTestCase(APITestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='admin', password='adminpass123')
+        self.user = User.objects.create_user(username='reader', password='readerpass123')
+        self.genre = Genre.objects.create(name='Fiction')
+        self.book = Book.objects.create(title='Test Book', author='Test Author', genre=self.genre)
+
+    def test_rollup_is_incremental(self):
+        Borrow.objects.create(user=self.user, book=self.book, returned=True, returned_on=timezone.now())
+        Review.objects.create(user=self.user, book=self.book, rating=4)
+        call_command('rollup_analytics', stdout=StringIO())
+        call_command('rollup_analytics', stdout=StringIO())
+
+        rollup = DailyBorrowRollup.objects.get(genre=self.genre)
+        self.assertEqual(rollup.borrows, 1)
+        self.assertEqual(rollup.returns, 1)
+        self.assertEqual(DailyRatingRollup.objects.get(genre=self.genre, rating=4).count, 1)
+
+        Borrow.objects.create(user=self.admin, book=self.book)
+        call_command('rollup_analytics', stdout=StringIO())
+        rollup.refresh_from_db()
+        self.assertEqual(rollup.borrows, 2)
+
+    def test_rollup_counts_late_commits_and_rating_edits(self):
+        call_command('rollup_analytics', stdout=StringIO())
+        # A loan stamped before the last run but committed after it.
+        late = Borrow.objects.create(user=self.user, book=self.book)
+        stamped = timezone.now() - timedelta(seconds=30)
+        Borrow.objects.filter(pk=late.pk).update(borrowed_on=stamped, returned=True, returned_on=stamped)
+        review = Review.objects.create(user=self.user, book=self.book, rating=2)
+        call_command('rollup_analytics', stdout=StringIO())
+
+        review.rating = 5
+        review.save()
+        call_command('rollup_analytics', stdout=StringIO())
+        call_command('rollup_analytics', stdout=StringIO())
+
+        rollup = DailyBorrowRollup.objects.get(genre=self.genre)
+        self.assertEqual((rollup.borrows, rollup.returns), (1, 1))
+        ratings = dict(DailyRatingRollup.objects.filter(genre=self.genre).values_list('rating', 'count'))
+        self.assertEqual(ratings, {2: 0, 5: 1})
+
+    def test_analytics_endpoint_is_admin_only(self):
+        Borrow.objects.create(user=self.user, book=self.book)
+        call_command('rollup_analytics', stdout=StringIO())
+
+        self.client.force_authenticate(self.user)
+        response = self.client.get('/api/analytics/')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.force_authenticate(self.admin)
+        response = self.client.get('/api/analytics/', {'genre': 'Fiction'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['borrows'][0]['borrows'], 1)
+
+        for params in ({'start': '2024-02-30'}, {'start': 'yesterday'}, {'end': ''},
+                       {'start': '2024-03-02', 'end': '2024-03-01'}):
+            response = self.client.get('/api/analytics/', params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+
+class AdminTestCase(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='admin', password='adminpass123')
+        self.genre = Genre.objects.create(name='Fiction')
+        self.add_rows(0, 3)
+        self.client.force_login(self.admin)
+
+    def add_rows(self, start, stop):
+        for i in range(start, stop):
+            branch = Branch.objects.create(code=f'branch-{i}', name=f'Branch {i}')
+            book = Book.objects.create(title=f'Book {i}', author='Author', genre=self.genre, branch=branch)
+            Borrow.objects.create(user=self.admin, book=book, branch=branch)
+            Review.objects.create(user=self.admin, book=book, rating=4)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelists_do_not_query_per_row(self):
+        urls = ['/admin/book/book/', '/admin/book/borrow/', '/admin/book/review/']
+        before = [self.count_queries(url) for url in urls]
+        self.add_rows(3, 10)
+        self.assertEqual([self.count_queries(url) for url in urls], before)
+
+    def test_book_changelist_shows_average_rating(self):
+        response = self.client.get('/admin/book/book/', {'q': 'Book 1'})
+        self.assertContains(response, '4.0')
+
+
+class BorrowArchiveTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='reader', password='readerpass123')
+        self.genre = Genre.objects.create(name='Fiction')
+        self.old_book = Book.objects.create(title='Old Book', author='Author', genre=self.genre)
+        self.new_book = Book.objects.create(title='New Book', author='Author', genre=self.genre)
+        long_ago = timezone.now() - timedelta(days=400)
+        old = Borrow.objects.create(user=self.user, book=self.old_book, returned=True, returned_on=long_ago)
+        Borrow.objects.filter(pk=old.pk).update(borrowed_on=long_ago - timedelta(days=7))
+        Borrow.objects.create(user=self.user, book=self.new_book)
+        self.client.force_authenticate(self.user)
+
+    def test_archive_moves_old_returned_borrows(self):
+        call_command('archive_borrows', '--batch-size', '1', stdout=StringIO())
+        self.assertEqual(Borrow.objects.count(), 1)
+        archived = BorrowArchive.objects.get()
+        self.assertEqual(archived.book, self.old_book)
+
+    def test_history_and_stats_span_archive(self):
+        call_command('archive_borrows', stdout=StringIO())
+
+        response = self.client.get('/api/borrows/history/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(
+            [borrow['book']['title'] for borrow in response.data['results']],
+            ['New Book', 'Old Book']
+        )
+        self.assertTrue(response.data['results'][1]['returned'])
+
+        response = self.client.get('/api/profile/stats/')
+        self.assertEqual(response.data['total_books_borrowed'], 2)
+        self.assertEqual(response.data['books_returned'], 1)
+        self.assertEqual(response.data['favorite_genres'][0]['count'], 2)
+
+
+    def test_recommendations_use_archived_loans(self):
+        call_command('archive_borrows', stdout=StringIO())
+        Borrow.objects.all().delete()
+        sequel = Book.objects.create(title='Sequel', author='Author', genre=self.genre)
+        Book.objects.create(title='Elsewhere', author='Author', genre=Genre.objects.create(name='Poetry'))
+
+        response = self.client.get('/api/books/recommendations/')
+        self.assertEqual(response.data['message'], 'Book recommendations based on your reading history')
+        self.assertCountEqual([book['id'] for book in response.data['books']], [sequel.id, self.new_book.id])
+
+    def test_history_tolerates_archival_during_request(self):
+        load_history_entries = BorrowViewSet.load_history_entries
+
+        def archive_then_load(view, entries):
+            entries = list(entries)
+            call_command('archive_borrows', stdout=StringIO())
+            Borrow.objects.filter(book=self.new_book).delete()
+            return load_history_entries(view, entries)
+
+        with mock.patch.object(BorrowViewSet, 'load_history_entries', archive_then_load):
+            response = self.client.get('/api/borrows/history/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([borrow['book']['title'] for borrow in response.data['results']], ['Old Book'])
+
+class BorrowListingTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='listing', password='pass')
+        genre = Genre.objects.create(name='Essays')
+        reviewers = [User.objects.create_user(username=f'critic{i}', password='pass') for i in range(2)]
+        for i in range(12):
+            book = Book.objects.create(title=f'Essay {i}', author='Writer', genre=genre)
+            Borrow.objects.create(user=self.user, book=book, returned=i % 2 == 0, returned_on=timezone.now())
+            for reviewer, rating in zip(reviewers, [5, 2]):
+                Review.objects.create(user=reviewer, book=book, rating=rating)
+        # The archived loan sorts first in history, so every page touches both tables.
+        Borrow.objects.update(borrowed_on=timezone.now() - timedelta(days=30))
+        BorrowArchive.objects.create(id=999, user=self.user, book=book, borrowed_on=timezone.now() - timedelta(days=20),
+                                     returned_on=timezone.now() - timedelta(days=10))
+        self.client.force_authenticate(self.user)
+
+    def count_queries(self, url, page_size):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'page_size': page_size, 'returned': 'true'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(queries), response.data['results']
+
+    def test_borrow_listings_use_constant_queries(self):
+        for url in ['/api/borrows/', '/api/borrows/history/']:
+            small, _ = self.count_queries(url, 2)
+            large, results = self.count_queries(url, 50)
+            self.assertEqual(small, large, url)
+            self.assertEqual(results[0]['book']['average_rating'], 3.5)
+            self.assertEqual(results[0]['book']['review_count'], 2)
+            self.assertEqual(results[0]['book']['genre_name'], 'Essays')
+        self.assertEqual(len(results), 13)
+
+class AutocompleteTestCase(APITestCase):
+    def setUp(self):
+        book_index.reset()
+        self.genre = Genre.objects.create(name='Fiction')
+        self.popular = Book.objects.create(title='Harry Potter', author='J. K. Rowling', genre=self.genre, read_count=50)
+        self.other = Book.objects.create(title='Hard Times', author='Charles Dickens', genre=self.genre, read_count=5)
+
+    def tearDown(self):
+        book_index.reset()
+
+    def test_autocomplete_ranks_by_read_count(self):
+        response = self.client.get('/api/books/autocomplete/', {'q': 'Har'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([book['id'] for book in response.data['results']], [self.popular.id, self.other.id])
+
+        response = self.client.get('/api/books/autocomplete/', {'q': 'potter'})
+        self.assertEqual([book['id'] for book in response.data['results']], [self.popular.id])
+
+        response = self.client.get('/api/books/autocomplete/', {'q': 'rowl'})
+        self.assertEqual([book['id'] for book in response.data['results']], [self.popular.id])
+
+    def test_autocomplete_updates_incrementally(self):
+        self.client.get('/api/books/autocomplete/', {'q': 'har'})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other.read_count = 100
+            self.other.save()
+            Book.objects.create(title='Harvest', author='Someone', genre=self.genre)
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/books/autocomplete/', {'q': 'har', 'limit': 2})
+        self.assertEqual([book['id'] for book in response.data['results']], [self.other.id, self.popular.id])
+
+    def test_index_respects_memory_budget(self):
+        index = PrefixIndex(max_entries=8, rebuild_interval=600)
+        index.build()
+        self.assertEqual([book['id'] for book in index.search('h', 10)], [self.popular.id])
+
+
+    def test_full_index_evicts_least_read_book(self):
+        index = PrefixIndex(max_entries=8, rebuild_interval=600)
+        index.build()
+        index.update(self.other.id, self.other.title, self.other.author, 60)
+        index.update(999, 'Harbour', 'Nobody', 10)
+        self.assertEqual([book['id'] for book in index.search('har', 10)], [self.other.id, 999])
+        index.update(1000, 'Hardly', 'Anyone', 1)
+        self.assertEqual([book['id'] for book in index.search('har', 10)], [self.other.id, 999])
+
+    def test_concurrent_searches_share_one_rebuild(self):
+        started, release = threading.Event(), threading.Event()
+
+        def slow_build(index):
+            started.set()
+            release.wait(5)
+            index._built_at = time.monotonic()
+
+        with mock.patch.object(PrefixIndex, 'build', autospec=True, side_effect=slow_build) as build:
+            searches = [threading.Thread(target=book_index['default'].search, args=('har', 5)) for _ in range(3)]
+            searches[0].start()
+            started.wait(5)
+            for search in searches[1:]:
+                search.start()
+            release.set()
+            for search in searches:
+                search.join(5)
+        self.assertEqual(build.call_count, 1)
+
+class SchemaTestCase(TestCase):
+    def setUp(self):
+        schema_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(schema_dir.cleanup)
+        self.enterContext(override_settings(OPENAPI_SCHEMA_DIR=schema_dir.name))
+        clear_schema_cache()
+        self.addCleanup(clear_schema_cache)
+
+    def test_schema_is_served_with_etag(self):
+        response = self.client.get('/swagger.json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('/books/', response.json()['paths'])
+
+        response = self.client.get('/swagger.json', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_fingerprint_covers_settings_and_package_versions(self):
+        self.assertIn('booklending/settings.py', SCHEMA_SOURCES)
+        before = source_fingerprint()
+        with mock.patch('booklending.schema.version', return_value='0.0'):
+            self.assertNotEqual(source_fingerprint(), before)
+
+    def test_schema_is_loaded_from_disk_when_sources_unchanged(self):
+        call_command('generate_schema', stdout=StringIO())
+        with mock.patch('booklending.schema.generate_schema') as generate:
+            response = self.client.get('/swagger.yaml')
+        self.assertEqual(response.status_code, 200)
+        generate.assert_not_called()
+
+    def test_warm_up_preloads_schema(self):
+        warm_up()
+        with mock.patch('booklending.schema.write_schema') as write:
+            get_schema_documents()
+        write.assert_not_called()
+
+
+class LoadTestHelpersTestCase(TestCase):
+    def test_parse_mix(self):
+        self.assertEqual(parse_mix('browse=3,borrow=1'), {'browse': 3.0, 'borrow': 1.0})
+        with self.assertRaises(CommandError):
+            parse_mix('teleport=1')
+
+    def test_profile_startup_fails_when_probe_fails(self):
+        failed = subprocess.CompletedProcess([], 1, stdout='', stderr='import time: 1 | 1 | os\nImportError: boom')
+        with mock.patch('subprocess.run', return_value=failed):
+            with self.assertRaisesMessage(CommandError, 'ImportError: boom'):
+                call_command('profile_startup', stdout=StringIO())
+
+    def test_find_double_borrows(self):
+        since = timezone.now() - timedelta(minutes=1)
+        book = Book.objects.create(title='Hot Book', author='Author')
+        first = Borrow.objects.create(user=User.objects.create_user(username='a', password='pass'), book=book)
+        second = Borrow.objects.create(user=User.objects.create_user(username='b', password='pass'), book=book)
+        self.assertEqual(find_double_borrows([book.id], since), [(book.id, first.id, second.id)])
+
+        Borrow.objects.filter(pk=first.pk).update(returned=True, returned_on=second.borrowed_on - timedelta(seconds=1))
+        self.assertEqual(find_double_borrows([book.id], since), [])
+
+
+class SQLiteTuningTestCase(TestCase):
+    def test_file_backed_connection_uses_tuned_settings(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        handler = ConnectionHandler({'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(directory.name, 'tuned.sqlite3'),
+            'OPTIONS': settings.SQLITE_OPTIONS,
+        }})
+        tuned = handler['default']
+        self.addCleanup(tuned.close)
+
+        pragmas = {}
+        with tuned.cursor() as cursor:
+            for name in ('journal_mode', 'busy_timeout', 'synchronous'):
+                cursor.execute(f'PRAGMA {name}')
+                pragmas[name] = cursor.fetchone()[0]
+        # synchronous=NORMAL reads back as 1.
+        self.assertEqual(pragmas, {
+            'journal_mode': 'wal', 'busy_timeout': settings.SQLITE_PRAGMAS['busy_timeout'], 'synchronous': 1,
+        })
+
+        statements = []
+        tuned.connection.set_trace_callback(statements.append)
+        with mock.patch('django.db.transaction.get_connection', return_value=tuned):
+            with transaction.atomic():
+                with tuned.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+        self.assertEqual(statements[0], 'BEGIN IMMEDIATE')
+
+
+class BookReviewsTestCase(APITestCase):
+    def setUp(self):
+        self.book = Book.objects.create(title='Bestseller', author='Author')
+        for i, rating in enumerate([5, 5, 4, 2, 5]):
+            user = User.objects.create_user(username=f'reviewer{i}', password='pass')
+            Review.objects.create(user=user, book=self.book, rating=rating)
+
+    def test_reviews_are_paginated_with_histogram(self):
+        response = self.client.get(f'/api/books/{self.book.id}/reviews/', {'page_size': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIsNotNone(response.data['next'])
+        self.assertEqual(response.data['histogram'], {'1': 0, '2': 1, '3': 0, '4': 1, '5': 3})
+        self.assertEqual(response.data['review_count'], 5)
+        self.assertEqual(response.data['average_rating'], 4.2)
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual(len(response.data['results']), 2)
+
+        response = self.client.get(f'/api/books/{self.book.id}/reviews/', {'rating': 5})
+        self.assertEqual(len(response.data['results']), 3)
+
+    def test_rating_stats_follow_review_writes(self):
+        review = Review.objects.get(user__username='reviewer3')
+        review.rating = 3
+        review.save()
+        Review.objects.get(user__username='reviewer0').delete()
+
+        stats = BookRatingStats.objects.get(book=self.book)
+        self.assertEqual(stats.histogram, {'1': 0, '2': 0, '3': 1, '4': 1, '5': 2})
+        self.assertEqual(stats.rating_sum, 17)
+        self.assertEqual(stats.review_count, 4)
+
+    def test_deleting_book_removes_rating_stats(self):
+        self.book.delete()
+        self.assertFalse(BookRatingStats.objects.exists())
+
+
+class MyReviewUpsertTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='reader', password='readerpass123')
+        self.book = Book.objects.create(title='Test Book', author='Test Author')
+        self.client.force_authenticate(self.user)
+        self.url = f'/api/books/{self.book.id}/my-review/'
+
+    def test_requires_borrow(self):
+        response = self.client.put(self.url, {'rating': 5})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Review.objects.exists())
+
+    def test_upsert_creates_then_updates(self):
+        Borrow.objects.create(user=self.user, book=self.book)
+
+        response = self.client.put(self.url, {'rating': 4, 'comment': 'Good'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['book_title'], 'Test Book')
+
+        # Savepoint, locked book, previous rating, upsert, stats delta, event, release.
+        with self.assertNumQueries(7):
+            response = self.client.put(self.url, {'rating': 2, 'comment': 'Meh'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        review = Review.objects.get()
+        self.assertEqual((review.rating, review.comment), (2, 'Meh'))
+        stats = BookRatingStats.objects.get(book=self.book)
+        self.assertEqual((stats.review_count, stats.rating_sum, stats.rating_2, stats.rating_4), (1, 2, 1, 0))
+
+
+class MediaTestCase(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        self.book = Book.objects.create(
+            title='Cover Book', author='Author',
+            image=SimpleUploadedFile('Cover.PNG', b'0123456789', content_type='image/png')
+        )
+        self.url = self.book.image.url
+
+    def test_upload_uses_content_hash(self):
+        digest = hashlib.sha256(b'0123456789').hexdigest()
+        self.assertEqual(self.book.image.name, f'book_images/{digest[:2]}/{digest}.png')
+
+    def test_serves_file_with_immutable_cache_headers(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(response['Content-Type'], 'image/png')
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_range_requests(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=2-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), b'2345')
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-3')
+        self.assertEqual(b''.join(response.streaming_content), b'789')
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=20-')
+        self.assertEqual(response.status_code, 416)
+
+    @override_settings(MEDIA_SENDFILE_HEADER='X-Accel-Redirect')
+    def test_sendfile_offload(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/' + self.book.image.name)
+        self.assertEqual(response.content, b'')
+
+    def test_rejects_paths_outside_media_root(self):
+        response = self.client.get('/media/../manage.py')
+        self.assertEqual(response.status_code, 404)
+
+
+class BranchTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='patron', password='pass')
+        self.north = Branch.objects.create(code='north', name='North')
+        self.south = Branch.objects.create(code='south', name='South')
+        self.north_book = Book.objects.create(title='North Book', author='A', branch=self.north)
+        self.south_book = Book.objects.create(title='South Book', author='B', branch=self.south)
+
+    def test_books_are_scoped_to_requested_branch(self):
+        response = self.client.get('/api/books/', {'branch': 'north'})
+        self.assertEqual([book['id'] for book in response.data['results']], [self.north_book.id])
+
+        response = self.client.get('/api/books/', HTTP_X_BRANCH='south')
+        self.assertEqual([book['id'] for book in response.data['results']], [self.south_book.id])
+
+        response = self.client.get('/api/books/')
+        self.assertEqual(response.data['count'], 2)
+
+    def test_catalog_lookups_are_scoped_to_requested_branch(self):
+        book_index.reset()
+        self.addCleanup(book_index.reset)
+        genre = Genre.objects.create(name='Atlas')
+        Book.objects.filter(pk__in=[self.north_book.pk, self.south_book.pk]).update(genre=genre)
+
+        response = self.client.get('/api/books/autocomplete/', {'q': 'book', 'branch': 'north'})
+        self.assertEqual([book['id'] for book in response.data['results']], [self.north_book.id])
+        response = self.client.get('/api/books/autocomplete/', {'q': 'book', 'branch': 'east'})
+        self.assertEqual(response.data['results'], [])
+
+        response = self.client.get(f'/api/genres/{genre.id}/books/', HTTP_X_BRANCH='south')
+        self.assertEqual([book['id'] for book in response.data], [self.south_book.id])
+
+    def test_borrow_records_branch(self):
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post(f'/api/books/{self.south_book.id}/borrow/')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Borrow.objects.get(id=response.data['borrow_id']).branch, self.south)
+
+    @override_settings(BRANCH_DATABASES={'north': 'branch_north'})
+    def test_router_pins_queries_to_branch_database(self):
+        router = BranchRouter()
+        self.assertIsNone(router.db_for_read(Book))
+        token = current_branch.set('north')
+        try:
+            self.assertEqual(router.db_for_read(Book), 'branch_north')
+            self.assertEqual(router.db_for_write(Borrow), 'branch_north')
+            self.assertEqual(router.db_for_read(User), 'default')
+        finally:
+            current_branch.reset(token)
+        token = current_branch.set('unmapped')
+        try:
+            self.assertIsNone(router.db_for_read(Book))
+        finally:
+            current_branch.reset(token)
+
+
+
+@override_settings(BRANCH_DATABASES={'north': BRANCH_TEST_DB}, DATABASE_ROUTERS=['book.routers.BranchRouter'])
+class BranchDatabaseRoutingTestCase(APITestCase):
+    databases = {'default', BRANCH_TEST_DB}
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='commuter', password='pass')
+        branch = Branch.objects.using(BRANCH_TEST_DB).create(code='north', name='North')
+        self.book = Book.objects.using(BRANCH_TEST_DB).create(title='Branch Copy', author='A', branch=branch)
+        token = RefreshToken.for_user(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}', HTTP_X_BRANCH='north')
+
+    def test_accounts_are_mirrored_but_authenticated_on_default(self):
+        mirror = User.objects.using(BRANCH_TEST_DB).get(pk=self.user.pk)
+        self.assertEqual(mirror.username, 'commuter')
+
+        # A diverged mirror row must not decide who the token belongs to.
+        User.objects.using(BRANCH_TEST_DB).filter(pk=self.user.pk).update(username='impostor', is_staff=True)
+        self.assertEqual(self.client.get('/api/analytics/').status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_autocomplete_index_is_kept_per_database(self):
+        book_index.reset()
+        self.addCleanup(book_index.reset)
+        branch = Branch.objects.create(code='north', name='North')
+        with self.captureOnCommitCallbacks(execute=True):
+            Book.objects.create(title='Branch Decoy', author='B', branch=branch)
+
+        response = self.client.get('/api/books/autocomplete/', {'q': 'branch'})
+        self.assertEqual([book['title'] for book in response.data['results']], ['Branch Copy'])
+        self.client.credentials()
+        response = self.client.get('/api/books/autocomplete/', {'q': 'branch'})
+        self.assertEqual([book['title'] for book in response.data['results']], ['Branch Decoy'])
+
+    def test_borrow_writes_in_a_transaction_on_the_branch_database(self):
+        with CaptureQueriesContext(connections[BRANCH_TEST_DB]) as branch_queries, \
+                CaptureQueriesContext(connection) as default_queries:
+            response = self.client.post(f'/api/books/{self.book.id}/borrow/')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(any(q['sql'].startswith('SAVEPOINT') for q in branch_queries.captured_queries))
+        self.assertFalse(any(q['sql'].startswith('SAVEPOINT') for q in default_queries.captured_queries))
+        self.assertTrue(Borrow.objects.using(BRANCH_TEST_DB).filter(user=self.user, book_id=self.book.id).exists())
+        self.assertFalse(Borrow.objects.exists())
+
+        response = self.client.post(f'/api/books/{self.book.id}/return_book/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+class EventStreamTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='reader', password='pass')
+        self.genre = Genre.objects.create(name='Mystery')
+        self.book = Book.objects.create(title='Watched', author='A', genre=self.genre)
+        self.other = Book.objects.create(title='Unwatched', author='B')
+
+    def borrow(self, book):
+        self.client.force_authenticate(user=self.user)
+        return self.client.post(f'/api/books/{book.id}/borrow/')
+
+    def test_only_real_changes_are_published(self):
+        book = Book.objects.get(id=self.book.id)
+        book.title = 'Renamed'
+        book.save()
+        self.assertFalse(ChangeEvent.objects.exists())
+
+        self.borrow(self.book)
+        event = ChangeEvent.objects.get()
+        self.assertEqual(event.kind, ChangeEvent.AVAILABILITY)
+        self.assertEqual((event.book_id, event.genre_id), (self.book.id, self.genre.id))
+        self.assertEqual(event.payload, {'available': False, 'read_count': 1})
+
+    def test_fallback_replays_events_after_last_event_id(self):
+        response = self.client.get('/api/events/')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertIn('retry: ', response.content.decode())
+
+        self.borrow(self.other)
+        self.borrow(self.book)
+        Review.objects.create(user=self.user, book=self.book, rating=4)
+        response = self.client.get('/api/events/', {'book': self.book.id}, HTTP_LAST_EVENT_ID='0')
+        body = response.content.decode()
+        self.assertEqual(body.count('event: availability'), 1)
+        self.assertEqual(body.count('event: review'), 1)
+        self.assertIn(f'"book": {self.book.id}', body)
+
+        response = self.client.get('/api/events/', {'genre': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(EVENTS_POLL_INTERVAL=0.01)
+    async def test_stream_pushes_changes_to_subscribers(self):
+        response = await self.async_client.get('/api/events/', {'genre': self.genre.id})
+        chunks = aiter(response.streaming_content)
+        try:
+            self.assertIn(b'retry: ', await anext(chunks))
+            await sync_to_async(self.borrow)(self.other)
+            await sync_to_async(self.borrow)(self.book)
+            chunk = (await asyncio.wait_for(anext(chunks), 5)).decode()
+            self.assertIn('event: availability', chunk)
+            self.assertIn(f'"book": {self.book.id}', chunk)
+        finally:
+            await chunks.aclose()
+
+
+    @override_settings(EVENTS_BATCH_SIZE=1)
+    async def test_truncated_replay_ends_the_stream(self):
+        await sync_to_async(self.borrow)(self.book)
+        await sync_to_async(self.borrow)(self.other)
+        first = await ChangeEvent.objects.order_by('id').afirst()
+
+        response = await self.async_client.get('/api/events/', {'last_event_id': 0})
+        chunks = [chunk async for chunk in response.streaming_content]
+        body = b''.join(chunks).decode()
+        self.assertEqual(body.count('event: availability'), 1)
+        self.assertIn(f'id: {first.id}', body)
+        self.assertFalse(get_broker().subscriptions)
+
+    async def test_failed_replay_unsubscribes(self):
+        self.async_client.raise_request_exception = False
+        with mock.patch('book.events.filter_events', side_effect=RuntimeError):
+            response = await self.async_client.get('/api/events/', {'last_event_id': 0})
+        self.assertEqual(response.status_code, 500)
+        self.assertFalse(get_broker().subscriptions)
+
+class BatchTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='home', password='pass')
+        self.genre = Genre.objects.create(name='Poetry')
+        Book.objects.create(title='Verses', author='Poet', genre=self.genre)
+        token = RefreshToken.for_user(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_batch_shares_authentication(self):
+        paths = ['/api/books/?page_size=5', '/api/profile/stats/', '/api/genres/', '/api/borrows/']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/batch/', {'requests': paths}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['responses']
+        self.assertEqual([result['status'] for result in results], [200, 200, 200, 200])
+        self.assertEqual(results[0]['body']['results'][0]['title'], 'Verses')
+        self.assertEqual(results[1]['body']['total_books_borrowed'], 0)
+        user_lookups = [q for q in queries.captured_queries if 'FROM "auth_user"' in q['sql']]
+        self.assertEqual(len(user_lookups), 1)
+
+    def test_batch_rejects_unsupported_requests(self):
+        response = self.client.post('/api/batch/', {'requests': [
+            'https://example.com/api/books/', '/admin/', '/api/nothing/', '/api/books/1/borrow/'
+        ]}, format='json')
+        self.assertEqual([result['status'] for result in response.data['responses']], [400, 400, 404, 405])
+
+        with override_settings(BATCH_MAX_REQUESTS=2):
+            response = self.client.post('/api/batch/', {'requests': ['/api/genres/'] * 3}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_anonymous_batch_keeps_per_view_permissions(self):
+        self.client.credentials()
+        response = self.client.post('/api/batch/', {'requests': ['/api/genres/', '/api/profile/stats/']}, format='json')
+        self.assertEqual([result['status'] for result in response.data['responses']], [200, 401])
+
+
+class ParallelBatchTestCase(TransactionTestCase):
+    def test_parallel_batch_matches_sequential(self):
+        user = User.objects.create_user(username='parallel', password='pass')
+        Genre.objects.create(name='Drama')
+        client = APIClient()
+        client.force_authenticate(user=user)
+        body = {'requests': ['/api/genres/', '/api/books/', '/api/profile/stats/']}
+        sequential = client.post('/api/batch/', body, format='json').data
+        parallel = client.post('/api/batch/', {**body, 'parallel': True}, format='json').data
+        self.assertEqual(parallel, sequential)
+
+
+@override_settings(
+    THROTTLE_USER_REFILL_RATE=5,
+    THROTTLE_ENDPOINT_RATES={'book.recommendations': 200, 'book.search': 300, 'profile.stats': 300},
+)
+class ThrottlingTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(db_latency.reset)
+        self.user = User.objects.create_user(username='busy', password='pass')
+        self.other = User.objects.create_user(username='busier', password='pass')
+        self.book = Book.objects.create(title='Popular', author='A')
+        self.client.force_authenticate(user=self.user)
+
+    @override_settings(THROTTLE_USER_CAPACITY=12, THROTTLE_USER_REFILL_RATE=0.5)
+    def test_user_bucket_charges_endpoint_cost(self):
+        self.assertEqual(self.client.get('/api/books/recommendations/').status_code, status.HTTP_200_OK)
+        response = self.client.get('/api/books/recommendations/')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '16')
+        self.assertEqual(self.client.get('/api/genres/').status_code, status.HTTP_200_OK)
+
+    @override_settings(THROTTLE_ENDPOINT_RATES={'book.recommendations': 10})
+    def test_endpoint_bucket_is_shared_by_all_users(self):
+        self.assertEqual(self.client.get('/api/books/recommendations/').status_code, status.HTTP_200_OK)
+        self.client.force_authenticate(user=self.other)
+        response = self.client.get('/api/books/recommendations/')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(self.client.get('/api/profile/stats/').status_code, status.HTTP_200_OK)
+
+    @override_settings(THROTTLE_USER_REFILL_RATE=0, THROTTLE_ENDPOINT_RATES={'book.recommendations': 0})
+    def test_zero_rate_disables_bucket(self):
+        for _ in range(3):
+            self.assertEqual(self.client.get('/api/books/recommendations/').status_code, status.HTTP_200_OK)
+
+    def test_high_db_latency_sheds_by_priority(self):
+        with mock.patch.object(db_latency, 'current', return_value=100.0):
+            response = self.client.get('/api/books/recommendations/')
+            self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            self.assertEqual(response['Retry-After'], '5')
+            self.assertEqual(self.client.get('/api/books/', {'search': 'Pop'}).status_code, 503)
+            self.assertEqual(self.client.get('/api/genres/').status_code, status.HTTP_200_OK)
+            self.assertEqual(self.client.post(f'/api/books/{self.book.id}/borrow/').status_code, 201)
+
+        with mock.patch.object(db_latency, 'current', return_value=500.0):
+            self.assertEqual(self.client.get('/api/genres/').status_code, 503)
+            self.assertEqual(self.client.post(f'/api/books/{self.book.id}/return_book/').status_code, 200)
+
+    async def test_latency_middleware_times_queries_under_asgi(self):
+        async def get_response(request):
+            await Genre.objects.acount()
+            return HttpResponse()
+
+        middleware = DatabaseLatencyMiddleware(get_response)
+        self.assertTrue(iscoroutinefunction(middleware))
+        with mock.patch.object(db_latency, 'observe') as observe:
+            await middleware(RequestFactory().get('/'))
+            observe.assert_called_once()
+            await Genre.objects.acount()
+            observe.assert_called_once()
+
+    def test_latency_average_decays_when_idle(self):
+        tracker = LatencyTracker()
+        for _ in range(50):
+            tracker.observe(0.2)
+        self.assertGreater(tracker.current(), 150)
+        self.assertLess(tracker.current(tracker.updated + 30), 1)
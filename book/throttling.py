@@ -0,0 +1,128 @@
+"""
+Cost-aware throttling and load shedding.
+
+Every API request draws tokens from its caller's bucket and, for endpoints
+listed in ``THROTTLE_ENDPOINT_RATES``, from a bucket shared by all callers of
+that endpoint. Buckets live in the Django cache so all workers share them;
+updates are read-then-write, so concurrent requests can overdraw a bucket
+slightly. Empty buckets give 429 with ``Retry-After``. A rate of 0 or less
+turns that bucket off.
+
+Independently, ``DatabaseLatencyMiddleware`` keeps a moving average of query
+time. Once it crosses the threshold for a request's priority the request is
+refused with 503 and ``Retry-After`` before it reaches the database, so the
+critical borrow/return path keeps the capacity that is left.
+"""
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import exceptions, status
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+CRITICAL = 'critical'
+NORMAL = 'normal'
+LOW = 'low'
+
+
+class LoadShed(exceptions.APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Server is busy, please retry shortly.'
+    default_code = 'load_shed'
+
+    def __init__(self, wait, detail=None):
+        super().__init__(detail)
+        self.wait = wait
+
+
+class LatencyTracker:
+    """Moving average of database query time in this process, in milliseconds.
+
+    Each query moves the average by ``THROTTLE_LATENCY_ALPHA``; without new
+    queries it decays with a ``THROTTLE_LATENCY_DECAY`` second time constant,
+    so shedding lifts on its own once load drops.
+    """
+
+    def __init__(self):
+        self.value = 0.0
+        self.updated = time.monotonic()
+
+    def current(self, now=None):
+        now = time.monotonic() if now is None else now
+        return self.value * math.exp(-max(0.0, now - self.updated) / settings.THROTTLE_LATENCY_DECAY)
+
+    def observe(self, seconds):
+        now = time.monotonic()
+        value = self.current(now)
+        self.value = value + settings.THROTTLE_LATENCY_ALPHA * (seconds * 1000 - value)
+        self.updated = now
+
+    def reset(self):
+        self.value = 0.0
+        self.updated = time.monotonic()
+
+
+db_latency = LatencyTracker()
+
+
+def endpoint_key(request, view):
+    """``<basename>.<action>``, e.g. ``book.recommendations``; searches count as ``<basename>.search``."""
+    name = getattr(view, 'basename', None) or view.__class__.__name__.removesuffix('ViewSet').lower()
+    action = getattr(view, 'action', None) or request.method.lower()
+    if action == 'list' and getattr(view, 'search_fields', None) and request.query_params.get(api_settings.SEARCH_PARAM):
+        action = 'search'
+    return f'{name}.{action}'
+
+
+def refill(state, capacity, rate, now):
+    tokens, stamp = state if state else (capacity, now)
+    return min(capacity, tokens + (now - stamp) * rate)
+
+
+class CostThrottle(BaseThrottle):
+    cache_format = 'throttle:{scope}:{ident}'
+
+    def allow_request(self, request, view):
+        key = endpoint_key(request, view)
+        priority = settings.THROTTLE_PRIORITIES.get(key, NORMAL)
+        shed_after = settings.THROTTLE_SHED_LATENCY_MS.get(priority)
+        if shed_after is not None and db_latency.current() > shed_after:
+            raise LoadShed(wait=settings.THROTTLE_SHED_RETRY_AFTER)
+
+        if request.user and request.user.is_authenticated:
+            ident = f'user:{request.user.pk}'
+        else:
+            ident = f'anon:{self.get_ident(request)}'
+        buckets = {}
+        if settings.THROTTLE_USER_REFILL_RATE > 0:
+            buckets[self.cache_format.format(scope='user', ident=ident)] = (
+                settings.THROTTLE_USER_CAPACITY, settings.THROTTLE_USER_REFILL_RATE
+            )
+        rate = settings.THROTTLE_ENDPOINT_RATES.get(key, 0)
+        if rate > 0:
+            buckets[self.cache_format.format(scope='endpoint', ident=key)] = (rate, rate)
+        self.wait_seconds = 0
+        if not buckets:
+            return True
+
+        cost = settings.THROTTLE_COSTS.get(key, 1)
+        now = time.time()
+        states = cache.get_many(list(buckets))
+        tokens = {}
+        for cache_key, (capacity, rate) in buckets.items():
+            tokens[cache_key] = refill(states.get(cache_key), capacity, rate, now)
+            needed = min(cost, capacity)
+            if tokens[cache_key] < needed:
+                self.wait_seconds = max(self.wait_seconds, (needed - tokens[cache_key]) / rate)
+        if self.wait_seconds:
+            return False
+
+        for cache_key, (capacity, rate) in buckets.items():
+            tokens[cache_key] = (tokens[cache_key] - min(cost, capacity), now)
+        cache.set_many(tokens, timeout=max(math.ceil(capacity / rate) for capacity, rate in buckets.values()) + 1)
+        return True
+
+    def wait(self):
+        return self.wait_seconds
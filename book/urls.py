@@ -1,19 +1,25 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
+from .events import event_stream
 from .views import (
     UserViewSet, LoginViewSet, BookViewSet, BorrowViewSet, 
-    ReviewViewSet, GenreViewSet, UserProfileViewSet
+    ReviewViewSet, BranchViewSet, GenreViewSet, UserProfileViewSet, AnalyticsViewSet,
+    BatchViewSet
 )
 
 router = DefaultRouter()
 router.register(r'books', BookViewSet)
 router.register(r'borrows', BorrowViewSet, basename='borrow')
 router.register(r'reviews', ReviewViewSet, basename='review')
+router.register(r'branches', BranchViewSet)
 router.register(r'genres', GenreViewSet)
 router.register(r'profile', UserProfileViewSet, basename='profile')
+router.register(r'analytics', AnalyticsViewSet, basename='analytics')
+router.register(r'batch', BatchViewSet, basename='batch')
 
 urlpatterns = [
     path('register/', UserViewSet.as_view({'post': 'create'}), name='register'),
     path('login/', LoginViewSet.as_view({'post': 'create'}), name='login'),
+    path('events/', event_stream, name='events'),
     path('', include(router.urls)),
 ]
\ No newline at end of file
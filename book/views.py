@@ -1,14 +1,30 @@
 from rest_framework import viewsets, status, permissions, filters
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import PageNumberPagination, CursorPagination
 from django.contrib.auth.models import User
-from django.db.models import Q, Count, Avg
+from django.db import router
+from django.db.models import Q, Count, Avg, Sum, Value, Prefetch, FloatField
+from django.db.models.functions import Cast, Coalesce, NullIf
+from django.core.cache import cache
+from django.conf import settings
+from django.shortcuts import get_object_or_404
 from django.utils import timezone
+from django.utils.dateparse import parse_date
+from datetime import timedelta
+from collections import Counter
+import hashlib
 from django_filters.rest_framework import DjangoFilterBackend
 
-from .models import Book, Genre, Borrow, Review
-from .serializers import *
+from .models import Book, BookRatingStats, Branch, ChangeEvent, Genre, Borrow, BorrowArchive, Review, DailyBorrowRollup, DailyRatingRollup
+from .serializers import (
+    UserSerializer, RegisterSerializer, LoginSerializer, BookCreateSerializer,
+    BookListSerializer, BranchSerializer, GenreSerializer, BookSerializer, BorrowSerializer, ReviewSerializer,
+    MyReviewSerializer, BatchSerializer
+)
+from .autocomplete import book_index
+from .routers import atomic_for
+from .batch import run_batch
 from rest_framework_simplejwt.tokens import RefreshToken
 
 class StandardResultsSetPagination(PageNumberPagination):
@@ -16,6 +32,12 @@ class StandardResultsSetPagination(PageNumberPagination):
     page_size_query_param = 'page_size'
     max_page_size = 100
 
+class ReviewCursorPagination(CursorPagination):
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = '-created_at'
+
 class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = RegisterSerializer
@@ -60,6 +82,11 @@ class BookViewSet(viewsets.ModelViewSet):
     search_fields = ['title', 'author', 'description']
     ordering_fields = ['read_count', 'title', 'created_at']
     ordering = ['-created_at']
+    facet_fields = {
+        'genre': 'genre__name',
+        'available': 'available',
+        'author': 'author',
+    }
     
     def get_permissions(self):
         if self.action in ['create', 'update', 'partial_update', 'destroy']:
@@ -68,6 +95,43 @@ class BookViewSet(viewsets.ModelViewSet):
             permission_classes = [permissions.IsAuthenticatedOrReadOnly]
         return [permission() for permission in permission_classes]
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        branch = getattr(self.request, 'branch_code', None)
+        if branch:
+            queryset = queryset.filter(branch__code=branch)
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        requested = request.query_params.get('facets', '')
+        facets = [name for name in requested.split(',') if name in self.facet_fields]
+        if facets and isinstance(response.data, dict):
+            response.data['facets'] = self.get_facet_counts(
+                self.filter_queryset(self.get_queryset()), facets
+            )
+        return response
+
+    def get_facet_counts(self, queryset, facets):
+        """Count each requested facet with its own grouped query, cached briefly per filter."""
+        queryset = queryset.order_by().prefetch_related(None)
+        key = hashlib.md5(f'{facets}:{queryset.query}'.encode()).hexdigest()
+        cache_key = f'book-facets:{key}'
+        counts = cache.get(cache_key)
+        if counts is not None:
+            return counts
+
+        counts = {}
+        for name in facets:
+            # Grouping by one field at a time keeps each query's result to the facet's distinct values.
+            field = self.facet_fields[name]
+            rows = queryset.values(field).annotate(count=Count('id')).order_by('-count', field)
+            if name == 'author':
+                rows = rows[:settings.FACET_AUTHOR_LIMIT]
+            counts[name] = [{'value': row[field], 'count': row['count']} for row in rows]
+        cache.set(cache_key, counts, settings.FACET_CACHE_TIMEOUT)
+        return counts
+
     def get_serializer_class(self):
         if self.action == 'list':
             return BookListSerializer
@@ -77,18 +141,21 @@ class BookViewSet(viewsets.ModelViewSet):
 
     @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated])
     def borrow(self, request, pk=None):
-        book = self.get_object()
+        with atomic_for(Book):
+            # Lock the book so concurrent borrowers can't both see it as available.
+            book = get_object_or_404(Book.objects.select_for_update(), pk=pk)
+            self.check_object_permissions(request, book)
 
-        if not book.available:
-            return Response({"error": "Book not available"}, status=status.HTTP_400_BAD_REQUEST)
+            if not book.available:
+                return Response({"error": "Book not available"}, status=status.HTTP_400_BAD_REQUEST)
 
-        if Borrow.objects.filter(user=request.user, book=book, returned=False).exists():
-            return Response({"error": "You already borrowed this book"}, status=status.HTTP_400_BAD_REQUEST)
+            if Borrow.objects.filter(user=request.user, book=book, returned=False).exists():
+                return Response({"error": "You already borrowed this book"}, status=status.HTTP_400_BAD_REQUEST)
 
-        borrow = Borrow.objects.create(user=request.user, book=book)
-        book.available = False
-        book.read_count += 1
-        book.save()
+            borrow = Borrow.objects.create(user=request.user, book=book, branch_id=book.branch_id)
+            book.available = False
+            book.read_count += 1
+            book.save()
         
         return Response({
             "message": "Book borrowed successfully",
@@ -99,14 +166,15 @@ class BookViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated])
     def return_book(self, request, pk=None):
         try:
-            borrow = Borrow.objects.get(user=request.user, book_id=pk, returned=False)
-            borrow.returned = True
-            borrow.returned_on = timezone.now()
-            borrow.save()
+            with atomic_for(Borrow):
+                borrow = Borrow.objects.select_for_update().get(user=request.user, book_id=pk, returned=False)
+                borrow.returned = True
+                borrow.returned_on = timezone.now()
+                borrow.save()
 
-            book = borrow.book
-            book.available = True
-            book.save()
+                book = borrow.book
+                book.available = True
+                book.save()
 
             return Response({
                 "message": "Book returned successfully",
@@ -120,13 +188,19 @@ class BookViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'], permission_classes=[permissions.IsAuthenticated])
     def recommendations(self, request):
         user = request.user
-        borrowed = Borrow.objects.filter(user=user).select_related('book__genre')
+        # Archived loans are part of the reading history too.
+        borrowed_book_ids = set(Borrow.objects.filter(user=user).values_list('book', flat=True).union(
+            BorrowArchive.objects.filter(user=user).values_list('book', flat=True)
+        ))
+        books = Book.objects.all()
+        branch = getattr(request, 'branch_code', None)
+        if branch:
+            books = books.filter(branch__code=branch)
 
-        if borrowed.exists():
-            genre_ids = borrowed.values_list('book__genre', flat=True).distinct()
-            borrowed_book_ids = borrowed.values_list('book', flat=True)
+        if borrowed_book_ids:
+            genre_ids = Book.objects.filter(id__in=borrowed_book_ids).values('genre')
             
-            recommended_books = Book.objects.filter(
+            recommended_books = books.filter(
                 genre__in=genre_ids,
                 available=True
             ).exclude(
@@ -135,7 +209,7 @@ class BookViewSet(viewsets.ModelViewSet):
                 avg_rating=Avg('reviews__rating')
             ).order_by('-read_count', '-avg_rating')[:5]
         else:
-            recommended_books = Book.objects.filter(
+            recommended_books = books.filter(
                 available=True
             ).annotate(
                 avg_rating=Avg('reviews__rating')
@@ -143,17 +217,92 @@ class BookViewSet(viewsets.ModelViewSet):
 
         serializer = BookListSerializer(recommended_books, many=True)
         return Response({
-            "message": "Book recommendations based on your reading history" if borrowed.exists() 
+            "message": "Book recommendations based on your reading history" if borrowed_book_ids 
                       else "Popular book recommendations",
             "books": serializer.data
         })
 
-    @action(detail=True, methods=['get'])
+    @action(detail=True, methods=['put'], url_path='my-review', permission_classes=[permissions.IsAuthenticated])
+    def my_review(self, request, pk=None):
+        serializer = MyReviewSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        rating = serializer.validated_data['rating']
+
+        with atomic_for(Review):
+            # Lock the book first so concurrent PUTs (e.g. a double submit) run one
+            # after the other and each reads the rating the previous one wrote;
+            # otherwise both see no review and the stats count it twice.
+            book = get_object_or_404(
+                Book.objects.select_for_update().only('id', 'title', 'genre_id', 'branch_id'), pk=pk
+            )
+            previous_rating = Review.objects.filter(book=book, user=request.user).values_list(
+                'rating', flat=True
+            ).first()
+            review = Review.upsert_for_borrower(
+                request.user.id, book.id, rating, serializer.validated_data['comment']
+            )
+            if review is None:
+                return Response({"error": "You can only review books you have borrowed"},
+                              status=status.HTTP_400_BAD_REQUEST)
+            BookRatingStats.apply_review_change(book.id, added=rating, removed=previous_rating)
+            ChangeEvent.publish(ChangeEvent.REVIEW, book, review_id=review.id, rating=rating,
+                                created=previous_rating is None)
+
+        review.user = request.user
+        review.book = book
+        created = previous_rating is None
+        return Response(ReviewSerializer(review).data,
+                        status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'], permission_classes=[permissions.AllowAny])
+    def autocomplete(self, request):
+        try:
+            limit = int(request.query_params.get('limit', 10))
+        except ValueError:
+            limit = 10
+        limit = max(1, min(limit, settings.AUTOCOMPLETE_MAX_RESULTS))
+        branch_id = None
+        branch_code = getattr(request, 'branch_code', None)
+        if branch_code:
+            branch_id = Branch.objects.filter(code=branch_code).values_list('id', flat=True).first()
+            if branch_id is None:
+                return Response({'results': []})
+        index = book_index[router.db_for_read(Book)]
+        return Response({
+            'results': index.search(request.query_params.get('q', ''), limit, branch_id=branch_id)
+        })
+
+    @action(detail=True, methods=['get'], pagination_class=ReviewCursorPagination, filter_backends=[])
     def reviews(self, request, pk=None):
-        book = self.get_object()
-        reviews = Review.objects.filter(book=book).select_related('user')
-        serializer = ReviewSerializer(reviews, many=True)
-        return Response(serializer.data)
+        book = get_object_or_404(Book.objects.select_related('rating_stats'), pk=pk)
+        self.check_object_permissions(request, book)
+        reviews = Review.objects.filter(book=book).select_related('user', 'book')
+
+        rating = request.query_params.get('rating', None)
+        if rating:
+            if rating not in {'1', '2', '3', '4', '5'}:
+                return Response({"error": "Rating must be between 1 and 5"}, status=status.HTTP_400_BAD_REQUEST)
+            reviews = reviews.filter(rating=rating)
+
+        page = self.paginate_queryset(reviews)
+        response = self.get_paginated_response(ReviewSerializer(page, many=True).data)
+
+        stats = getattr(book, 'rating_stats', None) or BookRatingStats(book=book)
+        response.data['review_count'] = stats.review_count
+        response.data['average_rating'] = stats.average_rating
+        response.data['histogram'] = stats.histogram
+        return response
+
+def borrow_book_prefetch():
+    """Load borrowed books with rating figures from BookRatingStats in one query."""
+    books = Book.objects.select_related('genre').annotate(
+        rating_count=Coalesce('rating_stats__review_count', 0),
+        rating_average=Coalesce(
+            Cast('rating_stats__rating_sum', FloatField()) / NullIf('rating_stats__review_count', 0),
+            Value(0.0),
+        ),
+    )
+    return Prefetch('book', queryset=books)
 
 class BorrowViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = BorrowSerializer
@@ -161,7 +310,11 @@ class BorrowViewSet(viewsets.ReadOnlyModelViewSet):
     pagination_class = StandardResultsSetPagination
 
     def get_queryset(self):
-        queryset = Borrow.objects.filter(user=self.request.user).select_related('book', 'book__genre')
+        if getattr(self, 'swagger_fake_view', False):
+            return Borrow.objects.none()
+        queryset = Borrow.objects.filter(user=self.request.user).select_related('user').prefetch_related(
+            borrow_book_prefetch()
+        )
         
         returned = self.request.query_params.get('returned', None)
         if returned is not None:
@@ -173,21 +326,46 @@ class BorrowViewSet(viewsets.ReadOnlyModelViewSet):
 
     @action(detail=False, methods=['get'])
     def history(self, request):
-        borrows = Borrow.objects.filter(user=request.user).select_related('book', 'book__genre').order_by('-borrowed_on')
-        page = self.paginate_queryset(borrows)
+        live = Borrow.objects.filter(user=request.user).annotate(
+            archived=Value(False)
+        ).values_list('id', 'borrowed_on', 'archived')
+        archived = BorrowArchive.objects.filter(user=request.user).annotate(
+            archived=Value(True)
+        ).values_list('id', 'borrowed_on', 'archived')
+        entries = live.union(archived, all=True).order_by('-borrowed_on')
+
+        page = self.paginate_queryset(entries)
+        borrows = self.load_history_entries(page if page is not None else entries)
+        serializer = self.get_serializer(borrows, many=True)
         if page is not None:
-            serializer = self.get_serializer(page, many=True)
             return self.get_paginated_response(serializer.data)
-        
-        serializer = self.get_serializer(borrows, many=True)
         return Response(serializer.data)
 
+    def load_history_entries(self, entries):
+        entries = list(entries)
+        live_ids = [pk for pk, _, is_archived in entries if not is_archived]
+        live = Borrow.objects.select_related('user').prefetch_related(borrow_book_prefetch()).in_bulk(live_ids)
+        # Ids keep their value when archived, so loans archived since the page
+        # query are looked up in the archive too.
+        archived_ids = [pk for pk, _, is_archived in entries if is_archived or pk not in live]
+        archived = BorrowArchive.objects.select_related('user').prefetch_related(
+            borrow_book_prefetch()
+        ).in_bulk(archived_ids)
+        # Loans deleted in the meantime are left out of the page.
+        return [
+            live.get(pk) or archived[pk]
+            for pk, _, _ in entries
+            if pk in live or pk in archived
+        ]
+
 class ReviewViewSet(viewsets.ModelViewSet):
     serializer_class = ReviewSerializer
     permission_classes = [permissions.IsAuthenticated]
     pagination_class = StandardResultsSetPagination
 
     def get_queryset(self):
+        if getattr(self, 'swagger_fake_view', False):
+            return Review.objects.none()
         queryset = Review.objects.select_related('user', 'book')
         
         book_id = self.request.query_params.get('book', None)
@@ -202,7 +380,11 @@ class ReviewViewSet(viewsets.ModelViewSet):
 
     def perform_create(self, serializer):
         book = serializer.validated_data['book']
-        if not Borrow.objects.filter(user=self.request.user, book=book).exists():
+        has_borrowed = (
+            Borrow.objects.filter(user=self.request.user, book=book).exists()
+            or BorrowArchive.objects.filter(user=self.request.user, book=book).exists()
+        )
+        if not has_borrowed:
             from rest_framework.exceptions import ValidationError
             raise ValidationError("You can only review books you have borrowed")
         
@@ -214,6 +396,19 @@ class ReviewViewSet(viewsets.ModelViewSet):
             raise PermissionDenied("You can only edit your own reviews")
         serializer.save()
 
+class BranchViewSet(viewsets.ModelViewSet):
+    queryset = Branch.objects.all()
+    serializer_class = BranchSerializer
+    permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    lookup_field = 'code'
+
+    def get_permissions(self):
+        if self.action in ['create', 'update', 'partial_update', 'destroy']:
+            permission_classes = [permissions.IsAdminUser]
+        else:
+            permission_classes = [permissions.AllowAny]
+        return [permission() for permission in permission_classes]
+
 class GenreViewSet(viewsets.ModelViewSet):
     queryset = Genre.objects.all()
     serializer_class = GenreSerializer
@@ -230,6 +425,9 @@ class GenreViewSet(viewsets.ModelViewSet):
     def books(self, request, pk=None):
         genre = self.get_object()
         books = Book.objects.filter(genre=genre).select_related('genre').prefetch_related('reviews')
+        branch = getattr(request, 'branch_code', None)
+        if branch:
+            books = books.filter(branch__code=branch)
         
         page = self.paginate_queryset(books)
         if page is not None:
@@ -246,21 +444,85 @@ class UserProfileViewSet(viewsets.ViewSet):
     def stats(self, request):
         user = request.user
         
-        total_borrowed = Borrow.objects.filter(user=user).count()
+        total_archived = BorrowArchive.objects.filter(user=user).count()
+        total_borrowed = Borrow.objects.filter(user=user).count() + total_archived
         currently_borrowed = Borrow.objects.filter(user=user, returned=False).count()
-        total_returned = Borrow.objects.filter(user=user, returned=True).count()
+        total_returned = Borrow.objects.filter(user=user, returned=True).count() + total_archived
         total_reviews = Review.objects.filter(user=user).count()
         
-        favorite_genres = Borrow.objects.filter(user=user).values(
-            'book__genre__name'
-        ).annotate(
-            count=Count('book__genre')
-        ).order_by('-count')[:3]
+        genre_counts = Counter()
+        for borrows in (Borrow.objects.filter(user=user), BorrowArchive.objects.filter(user=user)):
+            for row in borrows.values('book__genre__name').annotate(count=Count('book__genre')).order_by():
+                genre_counts[row['book__genre__name']] += row['count']
+        favorite_genres = [
+            {'book__genre__name': name, 'count': count}
+            for name, count in genre_counts.most_common(3)
+        ]
         
         return Response({
             'total_books_borrowed': total_borrowed,
             'currently_borrowed': currently_borrowed,
             'books_returned': total_returned,
             'reviews_written': total_reviews,
-            'favorite_genres': list(favorite_genres)
-        })
\ No newline at end of file
+            'favorite_genres': favorite_genres
+        })
+
+class AnalyticsViewSet(viewsets.ViewSet):
+    permission_classes = [permissions.IsAdminUser]
+
+    def list(self, request):
+        dates = {}
+        for name in ('start', 'end'):
+            if name not in request.query_params:
+                continue
+            try:
+                dates[name] = parse_date(request.query_params[name])
+            except ValueError:
+                dates[name] = None
+            if dates[name] is None:
+                return Response({"error": "start and end must be valid dates (YYYY-MM-DD)"},
+                              status=status.HTTP_400_BAD_REQUEST)
+        end = dates.get('end') or timezone.localdate()
+        start = dates.get('start') or end - timedelta(days=30)
+        if start > end:
+            return Response({"error": "start must not be after end"}, status=status.HTTP_400_BAD_REQUEST)
+
+        borrow_rows = DailyBorrowRollup.objects.filter(day__range=(start, end))
+        rating_rows = DailyRatingRollup.objects.filter(day__range=(start, end))
+        genre = request.query_params.get('genre', None)
+        if genre:
+            borrow_rows = borrow_rows.filter(genre__name=genre)
+            rating_rows = rating_rows.filter(genre__name=genre)
+
+        borrows = borrow_rows.values('day').annotate(
+            borrows=Sum('borrows'),
+            returns=Sum('returns'),
+            loan_seconds=Sum('total_loan_seconds')
+        ).order_by('day')
+        ratings = rating_rows.values('day', 'rating').annotate(
+            count=Sum('count')
+        ).order_by('day', 'rating')
+
+        return Response({
+            'start': start,
+            'end': end,
+            'borrows': [{
+                'day': row['day'],
+                'borrows': row['borrows'],
+                'returns': row['returns'],
+                'average_loan_days': round(row['loan_seconds'] / row['returns'] / 86400, 2) if row['returns'] else None
+            } for row in borrows],
+            'ratings': list(ratings)
+        })
+
+class BatchViewSet(viewsets.ViewSet):
+    """Run several GET API requests in one round trip, sharing authentication."""
+    permission_classes = [permissions.AllowAny]
+    serializer_class = BatchSerializer
+
+    def create(self, request):
+        serializer = BatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        workers = settings.BATCH_MAX_WORKERS if serializer.validated_data['parallel'] else 1
+        responses = run_batch(request, serializer.validated_data['requests'], workers)
+        return Response({'responses': responses})
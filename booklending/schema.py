@@ -0,0 +1,140 @@
+"""
+Pre-generated OpenAPI schema.
+
+The schema is generated once (at build time by ``manage.py generate_schema``
+or lazily on the first request), written to ``OPENAPI_SCHEMA_DIR`` and served
+from memory with a content-hash ETag. It is regenerated only when the source
+files or settings that define the API, or the installed DRF and drf-yasg
+versions, change.
+"""
+import hashlib
+import threading
+from importlib.metadata import version
+from pathlib import Path
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.views.decorators.http import condition, require_GET
+
+SCHEMA_SOURCES = [
+    'booklending/urls.py',
+    'book/urls.py',
+    'book/views.py',
+    'book/serializers.py',
+    'book/models.py',
+    # REST_FRAMEWORK and SWAGGER_SETTINGS shape the generated schema.
+    'booklending/settings.py',
+    'booklending/schema.py',
+]
+SCHEMA_PACKAGES = ['djangorestframework', 'drf-yasg']
+
+FORMATS = {
+    '.json': 'application/json',
+    '.yaml': 'application/yaml',
+}
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def get_api_info():
+    from drf_yasg import openapi
+
+    return openapi.Info(
+        title="Book Lending API",
+        default_version='v1',
+        description="A comprehensive Book Lending and Recommendation System API",
+        terms_of_service="https://www.google.com/policies/terms/",
+        contact=openapi.Contact(email="contact@booklending.local"),
+        license=openapi.License(name="BSD License"),
+    )
+
+
+def source_fingerprint():
+    digest = hashlib.sha256()
+    for source in SCHEMA_SOURCES:
+        digest.update(source.encode())
+        digest.update((Path(settings.BASE_DIR) / source).read_bytes())
+    for package in SCHEMA_PACKAGES:
+        digest.update(f'{package}=={version(package)}'.encode())
+    return digest.hexdigest()
+
+
+def generate_schema():
+    from drf_yasg.codecs import OpenAPICodecJson, OpenAPICodecYaml
+    from drf_yasg.generators import OpenAPISchemaGenerator
+
+    schema = OpenAPISchemaGenerator(get_api_info()).get_schema(request=None, public=True)
+    return {
+        '.json': OpenAPICodecJson(validators=[]).encode(schema),
+        '.yaml': OpenAPICodecYaml(validators=[]).encode(schema),
+    }
+
+
+def write_schema(force=False):
+    """Load the schema from disk, regenerating it if the API sources changed."""
+    directory = Path(settings.OPENAPI_SCHEMA_DIR)
+    fingerprint_file = directory / 'swagger.fingerprint'
+    fingerprint = source_fingerprint()
+
+    stored = fingerprint_file.read_text() if fingerprint_file.exists() else None
+    if not force and stored == fingerprint:
+        try:
+            return {fmt: (directory / f'swagger{fmt}').read_bytes() for fmt in FORMATS}
+        except FileNotFoundError:
+            pass
+
+    documents = generate_schema()
+    directory.mkdir(parents=True, exist_ok=True)
+    for fmt, body in documents.items():
+        (directory / f'swagger{fmt}').write_bytes(body)
+    fingerprint_file.write_text(fingerprint)
+    return documents
+
+
+def get_schema_documents():
+    if not _cache:
+        with _lock:
+            if not _cache:
+                documents = write_schema()
+                _cache.update({
+                    fmt: (body, hashlib.sha256(body).hexdigest()) for fmt, body in documents.items()
+                })
+    return _cache
+
+
+def clear_schema_cache():
+    _cache.clear()
+
+
+def ui_view(renderer):
+    """Swagger UI / ReDoc page; drf_yasg's view machinery is imported on first use."""
+    view = None
+
+    def lazy_ui_view(request, *args, **kwargs):
+        nonlocal view
+        if view is None:
+            from drf_yasg.views import get_schema_view
+            from rest_framework import permissions
+
+            view = get_schema_view(
+                get_api_info(),
+                public=True,
+                permission_classes=(permissions.AllowAny,),
+            ).with_ui(renderer, cache_timeout=0)
+        return view(request, *args, **kwargs)
+
+    return lazy_ui_view
+
+
+def _schema_etag(request, format):
+    return get_schema_documents()[format][1]
+
+
+@require_GET
+@condition(etag_func=_schema_etag)
+def schema_view(request, format):
+    body, _ = get_schema_documents()[format]
+    response = HttpResponse(body, content_type=FORMATS[format])
+    response['Cache-Control'] = f'public, max-age={settings.OPENAPI_SCHEMA_MAX_AGE}'
+    return response
@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 from pathlib import Path
 from datetime import timedelta
 import os
+import sys
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -52,6 +53,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'book.middleware.BranchMiddleware',
+    'book.middleware.DatabaseLatencyMiddleware',
 ]
 
 ROOT_URLCONF = 'booklending.urls'
@@ -77,6 +80,25 @@ WSGI_APPLICATION = 'booklending.wsgi.application'
 import dj_database_url
 
 DATABASE_URL = os.environ.get('DATABASE_URL')
+
+# High-concurrency SQLite mode for single-node deployments
+SQLITE_TUNED = os.environ.get('SQLITE_TUNED', 'True').lower() == 'true'
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000)),
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+    'cache_size': -int(os.environ.get('SQLITE_CACHE_KB', 64000)),
+    'temp_store': 'MEMORY',
+}
+SQLITE_OPTIONS = {
+    'init_command': ';'.join(f'PRAGMA {name}={value}' for name, value in SQLITE_PRAGMAS.items()),
+    # Take the write lock when a transaction starts instead of on its first
+    # write, so concurrent writers wait on busy_timeout rather than deadlock.
+    'transaction_mode': 'IMMEDIATE',
+    'timeout': SQLITE_PRAGMAS['busy_timeout'] / 1000,
+}
+
 if DATABASE_URL:
     DATABASES = {
         'default': dj_database_url.parse(DATABASE_URL)
@@ -90,6 +112,8 @@ else:
                 'NAME': BASE_DIR / os.environ.get('DB_NAME', 'db.sqlite3'),
             }
         }
+        if SQLITE_TUNED:
+            DATABASES['default']['OPTIONS'] = SQLITE_OPTIONS
     else:
         DATABASES = {
             'default': {
@@ -102,6 +126,52 @@ else:
             }
         }
 
+# Multi-branch: optional per-branch databases, e.g.
+# BRANCH_DATABASE_URLS="north=postgres://...,south=postgres://..."
+BRANCH_DATABASES = {}
+for entry in filter(None, os.environ.get('BRANCH_DATABASE_URLS', '').split(',')):
+    code, _, url = entry.partition('=')
+    BRANCH_DATABASES[code.strip()] = f'branch_{code.strip()}'
+    DATABASES[BRANCH_DATABASES[code.strip()]] = dj_database_url.parse(url.strip())
+DATABASE_ROUTERS = ['book.routers.BranchRouter'] if BRANCH_DATABASES else []
+
+TESTING = sys.argv[1:2] == ['test']
+
+# A branch database for the routing tests; the test runner only creates it for
+# test cases that list it in ``databases``.
+if TESTING:
+    DATABASES['branch_test'] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / 'branch_test.sqlite3'}
+
+# Borrow archival
+BORROW_ARCHIVE_AFTER_DAYS = int(os.environ.get('BORROW_ARCHIVE_AFTER_DAYS', 365))
+BORROW_ARCHIVE_BATCH_SIZE = int(os.environ.get('BORROW_ARCHIVE_BATCH_SIZE', 1000))
+
+# Analytics rollups: rows stamped this many seconds before the last run are
+# re-read, so writes that commit late are still counted.
+ANALYTICS_REORDER_WINDOW = int(os.environ.get('ANALYTICS_REORDER_WINDOW', 300))
+
+# Faceted search
+FACET_CACHE_TIMEOUT = int(os.environ.get('FACET_CACHE_TIMEOUT', 60))
+FACET_AUTHOR_LIMIT = int(os.environ.get('FACET_AUTHOR_LIMIT', 10))
+
+# Autocomplete index
+AUTOCOMPLETE_MAX_ENTRIES = int(os.environ.get('AUTOCOMPLETE_MAX_ENTRIES', 200000))
+AUTOCOMPLETE_MAX_RESULTS = int(os.environ.get('AUTOCOMPLETE_MAX_RESULTS', 20))
+AUTOCOMPLETE_REBUILD_INTERVAL = int(os.environ.get('AUTOCOMPLETE_REBUILD_INTERVAL', 600))
+
+# Server-Sent Events (/api/events/)
+EVENTS_POLL_INTERVAL = float(os.environ.get('EVENTS_POLL_INTERVAL', 1.0))
+EVENTS_HEARTBEAT_INTERVAL = float(os.environ.get('EVENTS_HEARTBEAT_INTERVAL', 15))
+EVENTS_RETRY_MS = int(os.environ.get('EVENTS_RETRY_MS', 3000))
+EVENTS_REORDER_WINDOW = float(os.environ.get('EVENTS_REORDER_WINDOW', 2.0))
+EVENTS_BATCH_SIZE = int(os.environ.get('EVENTS_BATCH_SIZE', 500))
+EVENTS_QUEUE_SIZE = int(os.environ.get('EVENTS_QUEUE_SIZE', 100))
+EVENTS_RETENTION_HOURS = int(os.environ.get('EVENTS_RETENTION_HOURS', 24))
+
+# Batched GET sub-requests (/api/batch/)
+BATCH_MAX_REQUESTS = int(os.environ.get('BATCH_MAX_REQUESTS', 10))
+BATCH_MAX_WORKERS = int(os.environ.get('BATCH_MAX_WORKERS', 4))
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -132,6 +202,11 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 # Media files
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+MEDIA_IMMUTABLE_MAX_AGE = int(os.environ.get('MEDIA_IMMUTABLE_MAX_AGE', 31536000))
+MEDIA_MAX_AGE = int(os.environ.get('MEDIA_MAX_AGE', 3600))
+# Offload file transfer to the proxy: 'X-Accel-Redirect' (nginx) or 'X-Sendfile' (Apache/lighttpd)
+MEDIA_SENDFILE_HEADER = os.environ.get('MEDIA_SENDFILE_HEADER')
+MEDIA_SENDFILE_PREFIX = os.environ.get('MEDIA_SENDFILE_PREFIX', '/protected-media/')
 
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
@@ -149,6 +224,59 @@ REST_FRAMEWORK = {
         'rest_framework.filters.SearchFilter',
         'rest_framework.filters.OrderingFilter',
     ],
+    'DEFAULT_THROTTLE_CLASSES': [
+        'book.throttling.CostThrottle',
+    ],
+}
+
+# Throttling and load shedding (book/throttling.py). Costs and rates are in
+# tokens; keys are "<basename>.<action>", with searches as "<basename>.search".
+THROTTLE_USER_CAPACITY = int(os.environ.get('THROTTLE_USER_CAPACITY', 300))
+THROTTLE_USER_REFILL_RATE = float(os.environ.get('THROTTLE_USER_REFILL_RATE', 5))
+THROTTLE_COSTS = {
+    'book.recommendations': 10,
+    'book.search': 5,
+    'profile.stats': 5,
+    'borrow.history': 3,
+    'analytics.list': 5,
+}
+# Shared per-endpoint buckets: tokens per second across all callers.
+THROTTLE_ENDPOINT_RATES = {
+    'book.recommendations': int(os.environ.get('THROTTLE_RECOMMENDATIONS_RATE', 200)),
+    'book.search': int(os.environ.get('THROTTLE_SEARCH_RATE', 300)),
+    'profile.stats': int(os.environ.get('THROTTLE_STATS_RATE', 300)),
+}
+THROTTLE_PRIORITIES = {
+    'book.borrow': 'critical',
+    'book.return_book': 'critical',
+    'login.create': 'critical',
+    'book.recommendations': 'low',
+    'book.search': 'low',
+    'profile.stats': 'low',
+    'borrow.history': 'low',
+    'analytics.list': 'low',
+}
+# Average DB query time (ms) above which each priority is refused with 503.
+THROTTLE_SHED_LATENCY_MS = {
+    'low': float(os.environ.get('THROTTLE_SHED_LOW_MS', 50)),
+    'normal': float(os.environ.get('THROTTLE_SHED_NORMAL_MS', 200)),
+}
+THROTTLE_SHED_RETRY_AFTER = int(os.environ.get('THROTTLE_SHED_RETRY_AFTER', 5))
+THROTTLE_LATENCY_ALPHA = float(os.environ.get('THROTTLE_LATENCY_ALPHA', 0.1))
+THROTTLE_LATENCY_DECAY = float(os.environ.get('THROTTLE_LATENCY_DECAY', 5))
+if TESTING:
+    # Buckets are keyed by user id, which test cases reuse; ThrottlingTestCase
+    # turns them back on with its own rates.
+    THROTTLE_USER_REFILL_RATE = 0
+    THROTTLE_ENDPOINT_RATES = {}
+
+# Throttle buckets and facet counts must be shared by all workers in
+# production, e.g. CACHE_BACKEND=django.core.cache.backends.redis.RedisCache.
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    }
 }
 
 # JWT Configuration
@@ -180,6 +308,7 @@ CORS_ALLOW_HEADERS = [
     'dnt',
     'origin',
     'user-agent',
+    'x-branch',
     'x-csrftoken',
     'x-requested-with',
 ]
@@ -205,4 +334,13 @@ SWAGGER_SETTINGS = {
     },
     'USE_SESSION_AUTH': False,
     'JSON_EDITOR': True,
-}
\ No newline at end of file
+    'SPEC_URL': ('schema-json', {'format': '.json'}),
+}
+
+REDOC_SETTINGS = {
+    'SPEC_URL': ('schema-json', {'format': '.json'}),
+}
+
+# Pre-generated OpenAPI schema (see booklending/schema.py)
+OPENAPI_SCHEMA_DIR = BASE_DIR / os.environ.get('OPENAPI_SCHEMA_DIR', 'openapi')
+OPENAPI_SCHEMA_MAX_AGE = int(os.environ.get('OPENAPI_SCHEMA_MAX_AGE', 300))
\ No newline at end of file
@@ -0,0 +1,29 @@
+"""
+Warm-up run once in the gunicorn master when the app is preloaded.
+
+Everything built here (URL resolver, model/serializer metadata, the OpenAPI
+schema) is inherited by forked workers instead of being rebuilt on each
+worker's first request.
+"""
+import inspect
+
+from django.db import connections
+from django.urls import get_resolver
+from rest_framework import serializers as drf_serializers
+
+
+def warm_up():
+    resolver = get_resolver()
+    resolver.url_patterns
+    resolver.reverse_dict
+
+    from book import serializers
+    for _, serializer_class in inspect.getmembers(serializers, inspect.isclass):
+        if issubclass(serializer_class, drf_serializers.Serializer) and serializer_class.__module__ == serializers.__name__:
+            serializer_class(context={}).fields
+
+    from .schema import get_schema_documents
+    get_schema_documents()
+
+    # Workers must open their own database connections after the fork.
+    connections.close_all()
@@ -7,4 +7,5 @@ pip install -r requirements.txt
 cd booklending
 python manage.py makemigrations book
 python manage.py migrate
-python manage.py collectstatic --no-input
\ No newline at end of file
+python manage.py collectstatic --no-input
+python manage.py generate_schema
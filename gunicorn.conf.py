@@ -0,0 +1,21 @@
+# Gunicorn configuration: `gunicorn -c gunicorn.conf.py booklending.wsgi:application`
+# The events service uses the same file with
+# `-k uvicorn.workers.UvicornWorker booklending.asgi:application`.
+# Binds to $PORT and runs $WEB_CONCURRENCY workers (gunicorn defaults).
+import gc
+import os
+
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'True').lower() == 'true'
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 0))
+
+
+def when_ready(server):
+    if not preload_app:
+        return
+    from booklending.warmup import warm_up
+    warm_up()
+    # Move everything allocated so far out of the GC's tracked generations so
+    # collections in workers don't touch (and copy) the shared pages.
+    gc.freeze()
+    server.log.info('Application warmed up before forking workers')